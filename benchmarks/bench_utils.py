@@ -0,0 +1,44 @@
+import math
+import time
+import subprocess
+from datetime import datetime
+from typing import Dict, Any, List
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(seconds: List[float]) -> Dict[str, Any]:
+    """把一组耗时（秒）汇总为毫秒级的分布"""
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "mean_ms": sum(seconds) / len(seconds) * 1000,
+        "p50_ms": percentile(seconds, 50) * 1000,
+        "p90_ms": percentile(seconds, 90) * 1000,
+        "p99_ms": percentile(seconds, 99) * 1000,
+        "max_ms": max(seconds) * 1000,
+        "total_s": sum(seconds),
+    }
+
+class Timer:
+    """with Timer() as t: ... 之后 t.seconds 为耗时"""
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        return False
+
+def run_metadata() -> Dict[str, Any]:
+    """记录当前提交与时间，便于比较不同提交之间的结果"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "started_at": datetime.now().isoformat()}
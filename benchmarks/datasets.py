@@ -0,0 +1,103 @@
+import os
+import json
+import random
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+SET5_LQ = "LRbicx4"
+SET5_METHODS = ["GTmod12", "original", "LRbicx2", "LRbicx3"]
+SCENES = ["portrait", "animal", "nature", "texture", "object"]
+
+def synthesize_configs(set5_dir: str, num_tasks: int, seed: int = 0) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    以 Set5 为种子合成 methods.json / files.json 形式的配置
+
+    每个方法目录对应一个方法，图像列表由 Set5 图像复制扩充到 num_tasks / 方法数 条，
+    文件名带序号，场景等元数据随机变化。
+
+    Returns:
+        Tuple[Dict, List[Dict]]: 方法配置与图像列表
+    """
+    rng = random.Random(seed)
+    base_images = sorted(os.listdir(os.path.join(set5_dir, SET5_LQ)))
+    methods_config = {
+        "lq_path": os.path.join(set5_dir, SET5_LQ),
+        "methods": [{"name": method, "path": os.path.join(set5_dir, method)} for method in SET5_METHODS],
+    }
+
+    num_images = -(-num_tasks // len(SET5_METHODS))
+    files = []
+    for i in range(num_images):
+        base = base_images[i % len(base_images)]
+        stem, ext = os.path.splitext(base)
+        files.append({
+            "image": f"{stem}_{i:07d}{ext}",
+            "source": base,
+            "scene": rng.choice(SCENES),
+            "difficulty": rng.randint(1, 5),
+        })
+    return methods_config, files
+
+def build_pairs(methods_config: Dict[str, Any], files: List[Dict[str, Any]], num_tasks: int) -> List[Dict[str, Any]]:
+    """按 generate_annotation_pairs 的结构生成数据对（不检查文件是否存在）"""
+    lq_abs = Path(methods_config['lq_path']).absolute()
+    pairs = []
+    for item in files:
+        meta_data = {k: v for k, v in item.items() if k != 'image'}
+        for method in methods_config['methods']:
+            pairs.append({
+                'lq_image_path': str(lq_abs / item['image']),
+                'hq_image_path': str(Path(method['path']).absolute() / item['image']),
+                'meta_data': dict(meta_data),
+                'method_name': method['name'],
+                'image_name': item['image'],
+                'status': 'pending',
+            })
+            if len(pairs) >= num_tasks:
+                return pairs
+    return pairs
+
+def materialize(set5_dir: str, output_dir: str, methods_config: Dict[str, Any],
+                files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    在 output_dir 下为合成的文件名建立指向 Set5 原图的符号链接，并写出配置文件，
+    可直接用于 utils.import 与界面
+
+    Returns:
+        Dict: 指向 output_dir 的方法配置
+    """
+    dirs = [SET5_LQ] + [method['name'] for method in methods_config['methods']]
+    for name in dirs:
+        os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+        source_dir = os.path.abspath(os.path.join(set5_dir, name))
+        for item in files:
+            link = os.path.join(output_dir, name, item['image'])
+            if not os.path.lexists(link):
+                os.symlink(os.path.join(source_dir, item['source']), link)
+
+    config = {
+        "lq_path": os.path.join(output_dir, SET5_LQ),
+        "methods": [{"name": m['name'], "path": os.path.join(output_dir, m['name'])} for m in methods_config['methods']],
+    }
+    with open(os.path.join(output_dir, "methods.json"), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(output_dir, "files.json"), 'w', encoding='utf-8') as f:
+        json.dump(files, f, ensure_ascii=False)
+    return config
+
+def write_import_file(path: str, pairs: List[Dict[str, Any]], tag_name: str = "scene"):
+    """把数据对写成 NDJSON 格式的导入文件（与数据库文档结构一致，不带 _id）"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for pair in pairs:
+            doc = {
+                'lq_image_path': pair['lq_image_path'],
+                'hq_image_path': pair['hq_image_path'],
+                'tag': pair['meta_data'][tag_name],
+                'metadata': {'method_name': pair['method_name'], 'image_name': pair['image_name'], **pair['meta_data']},
+                'annotations': {},
+                'user_edited_text': '',
+                'status': 'pending',
+                'updated_at': None,
+                'last_updated_by': None,
+            }
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import sys
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+from database import Database
+from benchmarks.bench_utils import Timer, summarize, run_metadata
+from benchmarks.datasets import synthesize_configs, build_pairs, materialize, write_import_file
+
+TAG_NAME = "scene"
+LIST_PROJECTION = {"_id": 1, "status": 1, "tag": 1, "metadata.method_name": 1, "last_updated_by": 1, "updated_at": 1}
+
+def bench_initialize(db: Database, pairs: List[Dict[str, Any]], chunk_size: int) -> Dict[str, Any]:
+    latencies = []
+    inserted = 0
+    for start in range(0, len(pairs), chunk_size):
+        with Timer() as t:
+            result = db.initialize(pairs[start:start + chunk_size], TAG_NAME, chunk_size)
+        latencies.append(t.seconds)
+        inserted += result['inserted']
+    summary = summarize(latencies)
+    summary.update({"inserted": inserted, "docs_per_second": inserted / summary["total_s"] if latencies else 0.0})
+    return summary
+
+def bench_statistics(db: Database, repeats: int) -> Dict[str, Any]:
+    latencies = []
+    for _ in range(repeats):
+        with Timer() as t:
+            db.get_annotation_statistics()
+        latencies.append(t.seconds)
+    return summarize(latencies)
+
+def bench_pagination(db: Database, total: int, page_size: int, repeats: int) -> Dict[str, Any]:
+    """在不同深度比较 skip 分页与基于 _id 的键集分页"""
+    query = {"status": "pending"}
+    results = {}
+    for fraction in (0.0, 0.1, 0.5, 0.9, 0.99):
+        skip = int(total * fraction)
+        skip_latencies, key_latencies = [], []
+        anchor = db.find_with_pagination(query, max(skip - 1, 0), 1, {"_id": 1})
+        for _ in range(repeats):
+            with Timer() as t:
+                db.find_with_pagination(query, skip, page_size, LIST_PROJECTION)
+            skip_latencies.append(t.seconds)
+            if skip and anchor:
+                with Timer() as t:
+                    db.find_page_by_key(query, page_size, after_id=str(anchor[0]['_id']), projection=LIST_PROJECTION)
+                key_latencies.append(t.seconds)
+        results[f"skip_{skip}"] = {"skip": summarize(skip_latencies), "keyset": summarize(key_latencies)}
+    return results
+
+def bench_claims(db: Database, users: int, claims_per_user: int, save_ratio: float) -> Dict[str, Any]:
+    """N 个用户并发领取任务，并保存其中一部分"""
+    claim_latencies, save_latencies = [], []
+    lock = threading.Lock()
+    empty = 0
+
+    def worker(index: int):
+        nonlocal empty
+        user_id = f"bench_user_{users}_{index}"
+        for i in range(claims_per_user):
+            with Timer() as t:
+                task = db.get_next_pending_annotation(user_id)
+            with lock:
+                claim_latencies.append(t.seconds)
+            if not task:
+                with lock:
+                    empty += 1
+                return
+            if i < claims_per_user * save_ratio:
+                with Timer() as t:
+                    db.update_annotation_with_lock(str(task['_id']), user_id, {"Total score": 3}, "", "annotated")
+                with lock:
+                    save_latencies.append(t.seconds)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(worker, range(users)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "users": users,
+        "claim": summarize(claim_latencies),
+        "save": summarize(save_latencies),
+        "claims_per_second": len(claim_latencies) / elapsed if elapsed else 0.0,
+        "empty_claims": empty,
+    }
+
+def check_query_plans(db: Database) -> Dict[str, Any]:
+    """对热点查询执行 explain，返回各查询的执行计划及出现全表扫描的查询名"""
+    plans = db.explain_hot_queries()
+    return {"plans": plans, "collscans": [name for name, plan in plans.items() if plan["collscan"]]}
+
+def bench_export(db: Database, query: str) -> Dict[str, Any]:
+    with Timer() as t:
+        path, message = db.export_to_csv_for_download(query)
+    size = os.path.getsize(path)
+    os.remove(path)
+    return {"seconds": t.seconds, "bytes": size, "message": message}
+
+def bench_import(db: Database, set5_dir: str, count: int, batch_size: int) -> Dict[str, Any]:
+    methods_config, files = synthesize_configs(set5_dir, count, seed=1)
+    for item in files:
+        item['image'] = f"import_{item['image']}"
+    pairs = build_pairs(methods_config, files, count)
+
+    fd, path = tempfile.mkstemp(suffix=".ndjson")
+    os.close(fd)
+    try:
+        write_import_file(path, pairs, TAG_NAME)
+        batch_latencies = []
+        last = [time.perf_counter()]
+
+        def on_progress(_stats):
+            now = time.perf_counter()
+            batch_latencies.append(now - last[0])
+            last[0] = now
+
+        with Timer() as t:
+            stats = db.import_annotations_from_json(path, batch_size=batch_size, progress_callback=on_progress)
+        return {"seconds": t.seconds, "bytes": os.path.getsize(path), "batches": summarize(batch_latencies),
+                "docs_per_second": stats['inserted'] / t.seconds if t.seconds else 0.0, **stats}
+    finally:
+        os.remove(path)
+
+def run_size(args, num_tasks: int) -> Dict[str, Any]:
+    methods_config, files = synthesize_configs(args.set5_dir, num_tasks, seed=args.seed)
+    pairs = build_pairs(methods_config, files, num_tasks)
+
+    db = Database(mongodb_uri=args.mongodb_uri, db_name=args.db_name, collection_name="annotations",
+                  background_bootstrap=False)
+    db.ensure_schema()
+    result = {"tasks": num_tasks}
+    try:
+        print(f"[{num_tasks}] initialize_annotations")
+        result["initialize"] = bench_initialize(db, pairs, args.chunk_size)
+        print(f"[{num_tasks}] explain hot queries")
+        result["query_plans"] = check_query_plans(db)
+        print(f"[{num_tasks}] get_statistics")
+        result["get_statistics"] = bench_statistics(db, args.repeats)
+        print(f"[{num_tasks}] find_with_pagination")
+        result["pagination"] = bench_pagination(db, num_tasks, args.page_size, args.repeats)
+
+        result["get_next_pending"] = []
+        for users in args.users:
+            print(f"[{num_tasks}] get_next_pending x {users} users")
+            result["get_next_pending"].append(bench_claims(db, users, args.claims_per_user, args.save_ratio))
+
+        result["get_statistics_after_claims"] = bench_statistics(db, args.repeats)
+        print(f"[{num_tasks}] export_to_csv_for_download")
+        result["export_csv"] = bench_export(db, args.export_query)
+        print(f"[{num_tasks}] import_from_json")
+        result["import_from_json"] = bench_import(db, args.set5_dir, args.import_size or num_tasks, args.chunk_size)
+    finally:
+        db.close_connection()
+    return result
+
+def drop_bench_database(args):
+    db = Database(mongodb_uri=args.mongodb_uri, db_name=args.db_name, collection_name="annotations",
+                  background_bootstrap=False)
+    db.conn.client.drop_database(args.db_name)
+    db.close_connection()
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库热点路径基准测试（需要本地 mongod）")
+    parser.add_argument('--mongodb_uri', type=str, default='mongodb://localhost:27017/')
+    parser.add_argument('--db_name', type=str, default='annotation_bench', help='测试库，每个规模开始前会被清空')
+    parser.add_argument('--set5_dir', type=str, default='Set5')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--chunk_size', type=int, default=1000)
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--claims_per_user', type=int, default=50)
+    parser.add_argument('--save_ratio', type=float, default=0.5, help='领取后保存的比例')
+    parser.add_argument('--page_size', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--export_query', type=str, default='{}')
+    parser.add_argument('--import_size', type=int, default=None, help='导入测试的数据条数，默认与规模相同')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--materialize_dir', type=str, default=None,
+                        help='为最大规模的数据集建立指向 Set5 的符号链接并写出 methods.json/files.json')
+    parser.add_argument('--output', type=str, default=None, help='结果JSON输出路径')
+    args = parser.parse_args()
+
+    if "bench" not in args.db_name:
+        parser.error("为避免误删数据，--db_name 必须包含 'bench'")
+
+    if args.materialize_dir:
+        methods_config, files = synthesize_configs(args.set5_dir, max(args.sizes), seed=args.seed)
+        materialize(args.set5_dir, args.materialize_dir, methods_config, files)
+        print(f"合成数据集已写入 {args.materialize_dir}")
+
+    results = {"meta": run_metadata(), "args": vars(args), "sizes": []}
+    for num_tasks in args.sizes:
+        drop_bench_database(args)
+        results["sizes"].append(run_size(args, num_tasks))
+
+    output = json.dumps(results, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}")
+    else:
+        print(output)
+
+    collscans = {size["tasks"]: size["query_plans"]["collscans"] for size in results["sizes"]
+                 if size.get("query_plans", {}).get("collscans")}
+    if collscans:
+        print(f"热点查询出现全表扫描（COLLSCAN）: {collscans}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, Any, List
+
+from PIL import Image
+
+from benchmarks.bench_utils import percentile, run_metadata
+
+SET5_LQ = "LRbicx4"
+SET5_METHODS = ["GTmod12", "original", "LRbicx2", "LRbicx3"]
+ERROR_PREFIXES = ("AI生成评价失败", "生成文本时出错", "图像数据为空")
+
+def load_set5_pairs(set5_dir: str) -> List[Dict[str, Any]]:
+    """以 LRbicx4 为 LQ、各方法目录为 HQ 组成图像对"""
+    pairs = []
+    lq_dir = os.path.join(set5_dir, SET5_LQ)
+    for name in sorted(os.listdir(lq_dir)):
+        lq_image = Image.open(os.path.join(lq_dir, name)).convert("RGB")
+        for method in SET5_METHODS:
+            hq_path = os.path.join(set5_dir, method, name)
+            if os.path.exists(hq_path):
+                pairs.append({"name": name, "method": method, "lq": lq_image,
+                              "hq": Image.open(hq_path).convert("RGB")})
+    return pairs
+
+async def run_level(pairs: List[Dict[str, Any]], concurrency: int, requests: int, args) -> Dict[str, Any]:
+    from config import OPTIONS
+    from services.llm_service import AsyncLLMClient, generate_text, set_async_llm_client
+
+    client = AsyncLLMClient(model=args.model, max_concurrency=concurrency, timeout=args.timeout,
+                            base_url=args.base_url, api_key=args.api_key)
+    set_async_llm_client(client)
+    ratings = {angle: opts["value"] for angle, opts in OPTIONS.items()}
+    latencies = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        pair = pairs[i % len(pairs)]
+        # 标签中带上级别与序号，保证每个请求都不命中文本缓存
+        tag = f"bench-c{concurrency}-{i}"
+        started = time.perf_counter()
+        result = await generate_text(ratings, pair["lq"], pair["hq"], tag)
+        latencies.append(time.perf_counter() - started)
+        if result.startswith(ERROR_PREFIXES):
+            errors += 1
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(i) for i in range(requests)))
+    finally:
+        await client.close()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def payload_sizes(pairs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """按当前 LLM_IMAGE_* 配置统计每个请求的图像负载大小"""
+    from services.llm_service import encode_image_data
+
+    sizes = []
+    for pair in pairs:
+        sizes.append(sum(encode_image_data(pair[key])[1]["bytes"] for key in ("lq", "hq")))
+    return {
+        "min_kb": min(sizes) / 1024,
+        "mean_kb": sum(sizes) / len(sizes) / 1024,
+        "max_kb": max(sizes) / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="generate_text 吞吐与延迟压测")
+    parser.add_argument('--set5_dir', type=str, default='Set5')
+    parser.add_argument('--base_url', type=str, default='http://127.0.0.1:8001/v1', help='默认指向本地替身服务')
+    parser.add_argument('--model', type=str, default='mock')
+    parser.add_argument('--api_key', type=str, default='mock')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--requests', type=int, default=200, help='每个并发级别的请求数量')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', type=str, default=None, help='结果JSON输出路径')
+    args = parser.parse_args()
+
+    # 在导入服务模块前指定一次性的缓存目录，避免压测结果被旧缓存污染
+    os.environ['LLM_CACHE_DIR'] = tempfile.mkdtemp(prefix="llm_bench_cache_")
+
+    pairs = load_set5_pairs(args.set5_dir)
+    print(f"载入 {len(pairs)} 个 Set5 图像对")
+    results = {"meta": run_metadata(), "payload": payload_sizes(pairs), "levels": []}
+    print(f"单请求图像负载: {results['payload']}")
+
+    for concurrency in args.concurrency:
+        level = asyncio.run(run_level(pairs, concurrency, args.requests, args))
+        results["levels"].append(level)
+        print(f"并发 {concurrency:>3}: {level['requests_per_second']:.1f} 请求/秒, "
+              f"p50 {level['p50_ms']:.0f} ms, p99 {level['p99_ms']:.0f} ms, 错误 {level['errors']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+def create_app(latency: float = 0.5, jitter: float = 0.1, error_rate: float = 0.0) -> FastAPI:
+    """
+    兼容 OpenAI chat.completions 接口的本地替身服务，用于在不访问真实付费接口的情况下压测
+
+    Args:
+        latency: 平均响应延迟（秒）
+        jitter: 延迟的随机波动范围（秒）
+        error_rate: 返回 500 错误的概率
+    """
+    app = FastAPI()
+    app.state.stats = {"requests": 0, "errors": 0, "request_bytes": 0, "images": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.body()
+        payload = await request.json()
+        stats = app.state.stats
+        stats["requests"] += 1
+        stats["request_bytes"] += len(body)
+        images = sum(
+            1 for msg in payload.get("messages", []) if isinstance(msg.get("content"), list)
+            for part in msg["content"] if part.get("type") == "image_url"
+        )
+        stats["images"] += images
+
+        await asyncio.sleep(max(0.0, random.uniform(latency - jitter, latency + jitter)))
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "模拟的服务端错误", "type": "server_error"}})
+
+        content = f"Mock evaluation of {images} images ({len(body)} bytes)."
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(body) + len(content)) // 4}
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return app.state.stats
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='平均响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.1, help='延迟随机波动（秒）')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='返回错误的概率')
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.latency, args.jitter, args.error_rate), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
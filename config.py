@@ -2,8 +2,30 @@
 import os
 os.environ['GRADIO_TEMP_DIR'] = './gradio_tmp'
 
-# LLM 模型配置
-LLM_MODEL_NAME = "qwen3-vl-plus"
+# LLM 模型配置（兼容 OpenAI 接口的服务地址、模型名与密钥）
+LLM_BASE_URL = os.environ.get('LLM_BASE_URL', "https://dashscope.aliyuncs.com/compatible-mode/v1")
+LLM_MODEL_NAME = os.environ.get('LLM_MODEL_NAME', "qwen3-vl-plus")
+LLM_API_KEY = os.environ.get('LLM_API_KEY', os.environ.get('DASHSCOPE_API_KEY', ""))
+# 只有配置了密钥或服务地址时才真正调用 LLM（调用会产生费用）
+LLM_ENABLED = bool(LLM_API_KEY) or 'LLM_BASE_URL' in os.environ
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))  # 同时进行中的请求上限
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))  # 单次请求超时（秒）
+
+# 发送给 LLM 的图像：最长边、编码格式（jpeg/webp）与质量
+LLM_IMAGE_MAX_SIDE = int(os.environ.get('LLM_IMAGE_MAX_SIDE', 1024))
+LLM_IMAGE_FORMAT = os.environ.get('LLM_IMAGE_FORMAT', 'jpeg')
+LLM_IMAGE_QUALITY = int(os.environ.get('LLM_IMAGE_QUALITY', 85))
+
+# 生成文本缓存（按图像内容、评分、标签、模型和提示词版本寻址）
+LLM_CACHE_DIR = os.environ.get('LLM_CACHE_DIR', './llm_cache')
+LLM_CACHE_MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# 预领取任务：租约很短，只有真正取用时才续期为完整租约；取用时最多等待预领取完成的秒数
+PREFETCH_LEASE_SECONDS = int(os.environ.get('PREFETCH_LEASE_SECONDS', 120))
+PREFETCH_WAIT_SECONDS = float(os.environ.get('PREFETCH_WAIT_SECONDS', 2))
+
+# 解码后图像缓存的内存上限（字节）
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
 
 OPTIONS = {
     "Dimension 1": {
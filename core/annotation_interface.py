@@ -1,13 +1,25 @@
+import threading
+import logging
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Dict, Any, Optional, Tuple
-from utils.image_utils import open_image
+from utils.image_utils import open_task_images
 from database import Database
 from services.llm_service import generate_text
-from config import OPTIONS
+from config import OPTIONS, PREFETCH_LEASE_SECONDS, PREFETCH_WAIT_SECONDS
+from utils.metrics import instrument_methods, action_scope
 
+logger = logging.getLogger(__name__)
+
+@instrument_methods("annotation_handler", "handler")
 class AnnotationBusinessLogic:
-    def __init__(self, db_interface: Database):
+    def __init__(self, db_interface: Database, prefetch_workers: int = 4):
         self.db = db_interface
         self.annotation_options = OPTIONS
+        # 预取：在用户标注当前任务时，后台准备好“下一张”
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="prefetch") if prefetch_workers > 0 else None
+        self._prefetched_claims = {}  # user_id -> Future[Optional[Dict]]
+        self._prefetch_lock = threading.Lock()
 
     # ==================== 用户管理 ====================
     def login_user(self, username: str) -> Tuple[Optional[str], str]:
@@ -46,118 +58,203 @@ class AnnotationBusinessLogic:
             'user_text': ""
         }
 
-    def load_task_by_id(self, task_id: str, user_id: str) -> Dict[str, Any]:
+    def _build_task_result(self, task: Dict[str, Any], full_resolution: bool = False) -> Dict[str, Any]:
+        lq_pil, hq_pil = open_task_images(task, full_resolution)
+
+        current_annotations = task.get('annotations', {})
+        selected_options = {
+            angle: current_annotations.get(angle, opts["value"])
+            for angle, opts in self.annotation_options.items()
+        }
+        user_text = task.get('user_edited_text', '')
+        status_msg = f"当前任务: {task['_id']} | 状态: {task['status']} | 方法: {task.get('metadata', {}).get('method_name', 'N/A')} | 标签: {task.get('tag', 'N/A')}"
+        # 尚未编辑时以预生成的文本作为草稿
+        if not user_text and task.get('generated_text'):
+            user_text = task['generated_text']
+            status_msg += " | 已载入AI草稿"
+
+        return {
+            'lq_image': lq_pil,
+            'hq_image': hq_pil,
+            'status': status_msg,
+            'selected_options': selected_options,
+            'user_text': user_text
+        }
+
+    def load_task_by_id(self, task_id: str, user_id: str, full_resolution: bool = False) -> Dict[str, Any]:
         if not user_id:
             return self._empty_task("请先登录")
         try:
             task = self.db.get_annotation_by_id(task_id)
             if not task:
                 return self._empty_task("任务不存在")
-
-            lq_pil = open_image(task['lq_image_path'])
-            hq_pil = open_image(task['hq_image_path'])
-
-            current_annotations = task.get('annotations', {})
-            selected_options = {
-                angle: current_annotations.get(angle, opts["value"])
-                for angle, opts in self.annotation_options.items()
-            }
-            user_text = task.get('user_edited_text', '')
-            status_msg = f"当前任务: {task['_id']} | 状态: {task['status']} | 方法: {task.get('metadata', {}).get('method_name', 'N/A')} | 标签: {task.get('tag', 'N/A')}"
-
-            return {
-                'lq_image': lq_pil,
-                'hq_image': hq_pil,
-                'status': status_msg,
-                'selected_options': selected_options,
-                'user_text': user_text
-            }
+            return self._build_task_result(task, full_resolution)
         except Exception as e:
             return self._empty_task(f"加载任务失败: {str(e)}")
 
-    def load_next_task(self, user_id: str) -> Dict[str, Any]:
+    def load_next_task(self, user_id: str, full_resolution: bool = False) -> Dict[str, Any]:
         if not user_id:
             return self._empty_task("请先登录")
         try:
-            history = self.db.get_user_task_history(user_id)
-            current_index = self.db.get_user_current_history_index(user_id)
-            if history and current_index < len(history) - 1:
-                new_index = current_index + 1
-                self.db.update_user_current_history_index(user_id, new_index)
-                task = history[new_index]
-                return self.load_task_by_id(task['_id'], user_id)
-
-            task = self.db.get_next_pending_annotation(user_id)
+            # 历史中还有下一条时，直接前进
+            position = self.db.move_user_history(user_id, 1)
+            if position and position.get('task_id'):
+                result = self.load_task_by_id(position['task_id'], user_id, full_resolution)
+                self._schedule_prefetch(user_id)
+                return result
+
+            task = self._take_prefetched_claim(user_id)
+            if not task:
+                task = self.db.get_next_pending_annotation(user_id)
             if not task:
                 return self._empty_task("没有更多待标注的任务")
 
             # 添加到历史
             self.db.add_task_to_user_history(user_id, task)
 
-            lq_pil = open_image(task['lq_image_path'])
-            hq_pil = open_image(task['hq_image_path'])
-
-            current_annotations = task.get('annotations', {})
-            selected_options = {
-                angle: current_annotations.get(angle, opts["value"])
-                for angle, opts in self.annotation_options.items()
-            }
-            user_text = task.get('user_edited_text', '')
-            status_msg = f"当前任务: {task['_id']} | 状态: {task['status']} | 方法: {task.get('metadata', {}).get('method_name', 'N/A')} | 标签: {task.get('tag', 'N/A')}"
-
-            return {
-                'lq_image': lq_pil,
-                'hq_image': hq_pil,
-                'status': status_msg,
-                'selected_options': selected_options,
-                'user_text': user_text
-            }
+            result = self._build_task_result(task, full_resolution)
+            self._schedule_prefetch(user_id)
+            return result
         except Exception as e:
             return self._empty_task(f"加载任务失败: {str(e)}")
 
-    def load_previous_task(self, user_id: str) -> Dict[str, Any]:
+    def load_previous_task(self, user_id: str, full_resolution: bool = False) -> Dict[str, Any]:
         if not user_id:
             return self._empty_task("请先登录")
         try:
-            history = self.db.get_user_task_history(user_id)
-            if not history:
+            position = self.db.move_user_history(user_id, -1)
+            if not position or not position.get('length'):
                 return self._empty_task("没有历史任务")
 
-            current_index = self.db.get_user_current_history_index(user_id)
-            new_index = current_index - 1
-            self.db.update_user_current_history_index(user_id, new_index)
-            if new_index < 0:
+            if not position.get('task_id'):
                 return self._empty_task("已经是第一张任务")
             
-            task = history[new_index]
-            return self.load_task_by_id(task['_id'], user_id)
+            result = self.load_task_by_id(position['task_id'], user_id, full_resolution)
+            self._schedule_prefetch(user_id)
+            return result
         except Exception as e:
             return self._empty_task(f"加载上一张任务失败: {str(e)}")
-    
-    def get_tag(self, task_id: str) -> str:
+
+    def load_task_images(self, task_id: str, full_resolution: bool = False):
+        """按需加载任务图像（缩略图或原图）"""
+        if not task_id:
+            return None, None
         task = self.db.get_annotation_by_id(task_id)
-        return task.get('tag', '')
+        if not task:
+            return None, None
+        return open_task_images(task, full_resolution)
+
+    # ==================== 预取 ====================
+    def _schedule_prefetch(self, user_id: str):
+        """在后台准备该用户的下一张任务"""
+        if not self._prefetch_executor:
+            return
+        try:
+            # 复制当前上下文，预取产生的数据库命令归属到 "触发操作>prefetch"
+            self._prefetch_executor.submit(copy_context().run, self._prefetch_next, user_id)
+        except RuntimeError:
+            # 线程池已关闭
+            pass
+
+    def _prefetch_next(self, user_id: str):
+        """
+        历史中还有下一条时，仅预先解码其图像；
+        已在历史末尾时，预领取一个待标注任务（未加入历史）并解码图像。
+        预领取使用短租约，用户离开后未被取用的任务由租约清理回收。
+        """
+        try:
+            with action_scope("prefetch", nested=True):
+                next_task_id = self.db.peek_user_history_next(user_id)
+                if next_task_id:
+                    task = self.db.get_annotation_by_id(next_task_id)
+                    if task:
+                        open_task_images(task)
+                    return
+
+                with self._prefetch_lock:
+                    if user_id in self._prefetched_claims:
+                        return
+                    future = self._prefetch_executor.submit(copy_context().run, self._prefetch_claim, user_id)
+                    self._prefetched_claims[user_id] = future
+        except Exception as e:
+            logger.error(f"预取用户 {user_id} 的下一张任务时出错: {e}")
+
+    def _prefetch_claim(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with action_scope("claim", nested=True):
+            task = self.db.get_next_pending_annotation(user_id, lease_seconds=PREFETCH_LEASE_SECONDS)
+            if task:
+                open_task_images(task)
+            return task
+
+    def _release_claim_when_done(self, future, user_id: str):
+        """预领取完成后立即释放其租约（尚未完成时在完成回调中释放）"""
+        def release(done):
+            if done.cancelled():
+                return
+            try:
+                task = done.result()
+            except Exception:
+                return
+            if task:
+                self.db.release_annotation_lock(task['_id'], user_id)
+        future.add_done_callback(release)
+
+    def _take_prefetched_claim(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        取出预领取的任务，并续期为完整租约以确认其仍属于该用户
+
+        预领取未在 PREFETCH_WAIT_SECONDS 内完成时放弃等待（完成后释放），由调用方直接领取。
+        """
+        with self._prefetch_lock:
+            future = self._prefetched_claims.pop(user_id, None)
+        if future is None:
+            return None
+        try:
+            task = future.result(timeout=PREFETCH_WAIT_SECONDS)
+        except FutureTimeoutError:
+            logger.warning(f"用户 {user_id} 的预领取未及时完成，改为直接领取")
+            self._release_claim_when_done(future, user_id)
+            return None
+        except Exception as e:
+            logger.error(f"预领取任务失败: {e}")
+            return None
+        if task and self.db.renew_annotation_lease(task['_id'], user_id):
+            return task
+        return None
+
+    def release_prefetched(self, user_id: Optional[str] = None):
+        """释放未被使用的预领取任务的租约（user_id 为空时释放全部），不等待进行中的预领取"""
+        with self._prefetch_lock:
+            if user_id is None:
+                futures = list(self._prefetched_claims.items())
+                self._prefetched_claims.clear()
+            else:
+                future = self._prefetched_claims.pop(user_id, None)
+                futures = [(user_id, future)] if future else []
+        for uid, future in futures:
+            self._release_claim_when_done(future, uid)
+
+    def shutdown(self):
+        self.release_prefetched()
+        if self._prefetch_executor:
+            self._prefetch_executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_tag(self, task_id: str) -> str:
+        task = self.db.get_annotation_by_id(task_id) if task_id else None
+        return task.get('tag', '') if task else ''
 
     # ==================== 任务操作 ====================
     def cancel_current_task(self, user_id: str, task_id: str) -> str:
         if not user_id or not task_id:
             return "用户或任务ID缺失"
         try:
+            # 用户放弃当前任务时，同时释放为其预领取的下一张
+            self.release_prefetched(user_id)
             success = self.db.release_annotation_lock(task_id, user_id)
             if not success:
                 return "取消失败：可能无权限或任务未被分配"
             
-            history = self.db.get_user_task_history(user_id)
-            current_index = self.db.get_user_current_history_index(user_id)
-            
-            if history and 0 <= current_index < len(history):
-                current_task = history[current_index]
-                if str(current_task.get('_id')) == task_id:
-                    updated_history = history[:current_index] + history[current_index + 1:]
-                    self.db.update_history(user_id, updated_history)
-
-                    new_index = max(-1, current_index - 1)
-                    self.db.update_user_current_history_index(user_id, new_index)
+            self.db.remove_task_from_user_history(user_id, task_id)
 
             return f"任务 {task_id} 已取消并从历史中移除"
         except Exception as e:
@@ -193,8 +290,8 @@ class AnnotationBusinessLogic:
             return f"更新任务时出错: {str(e)}"
 
     # ==================== LLM & 统计 ====================
-    def generate_text_with_llm(self, selected_options: Dict[str, str], lq_image, hq_image, tag) -> str:
-        return generate_text(selected_options, lq_image, hq_image, tag)
+    async def generate_text_with_llm(self, selected_options: Dict[str, str], lq_image, hq_image, tag) -> str:
+        return await generate_text(selected_options, lq_image, hq_image, tag)
 
     def get_annotation_statistics(self) -> Dict[str, int]:
         return self.db.get_annotation_statistics()
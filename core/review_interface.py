@@ -1,19 +1,38 @@
 # core/review_business_logic.py
 import json
-from typing import Dict, Any, List, Tuple
-from utils.image_utils import open_image
+from typing import Dict, Any, List, Tuple, Optional
+from utils.image_utils import open_task_images
+from utils.cache_utils import TTLCache
 from database import Database
 from config import OPTIONS
 from services.llm_service import generate_text
+from utils.metrics import REGISTRY, instrument_methods, cache_samples
 
+@instrument_methods("annotation_handler", "handler")
 class ReviewBusinessLogic:
-    def __init__(self, db_interface: Database):
+    # 任务列表只展示这几列
+    LIST_PROJECTION = {
+        "metadata.method_name": 1,
+        "metadata.image_name": 1,
+        "status": 1,
+        "last_updated_by": 1,
+        "updated_at": 1,
+    }
+
+    def __init__(self, db_interface: Database, count_cache_ttl: float = 30):
         self.db = db_interface
         self.annotation_options = OPTIONS
+        self._count_cache = TTLCache(max_size=256, ttl=count_cache_ttl)
+        REGISTRY.register_collector("review_count_cache", lambda: cache_samples("review_count", self._count_cache.stats()))
+
+    def load_task_list(self, page: int, page_size: int, filter_status: str, role: str = 'admin', user_id: str = None,
+                       cursor: Optional[Dict[str, Any]] = None) -> Tuple[List[List[str]], int, int, Dict[str, Any]]:
+        """
+        加载分页任务列表
 
-    def load_task_list(self, page: int, page_size: int, filter_status: str, role: str = 'admin', user_id: str = None) -> Tuple[List[List[str]], int, int]:
-        """加载分页任务列表"""
-        skip = (page - 1) * page_size
+        如果 cursor 记录的是相邻页的首尾 _id，则按 _id 范围做键集翻页，否则退回 skip 分页。
+        只取列表展示需要的字段，总数使用带缓存的估算计数。
+        """
         if filter_status == "all":
             query = {}
         else:
@@ -24,16 +43,23 @@ class ReviewBusinessLogic:
             else:
                 # 未登录用户，返回空
                 query["_id"] = {"$exists": False}
-        cursor = self.db.find_with_pagination(query, skip, page_size)
-        total = self.db.count(query)
 
+        list_key = [filter_status, page_size, role, user_id]
+        cursor = cursor if cursor and cursor.get('key') == list_key else None
+        if cursor and page == cursor['page'] + 1 and cursor.get('last_id'):
+            docs = self.db.find_page_by_key(query, page_size, after_id=cursor['last_id'], projection=self.LIST_PROJECTION)
+        elif cursor and page == cursor['page'] - 1 and cursor.get('first_id'):
+            docs = self.db.find_page_by_key(query, page_size, before_id=cursor['first_id'], projection=self.LIST_PROJECTION)
+        else:
+            skip = (page - 1) * page_size
+            docs = self.db.find_with_pagination(query, skip, page_size, projection=self.LIST_PROJECTION)
+        total = self._cached_count(query)
+
+        users = self.db.get_users_by_ids(doc.get('last_updated_by') for doc in docs)
         table_data = []
-        for doc in cursor:
-            user_id_doc = doc.get('last_updated_by', '')
-            user_name = 'Unknown'
-            if user_id_doc:
-                user_doc = self.db.get_user_by_id(user_id_doc)
-                user_name = user_doc.username if user_doc else 'Unknown'
+        for doc in docs:
+            user_doc = users.get(doc.get('last_updated_by'))
+            user_name = user_doc.username if user_doc else 'Unknown'
             table_data.append([
                 str(doc['_id']),
                 doc.get('metadata', {}).get('method_name', 'N/A'),
@@ -43,22 +69,43 @@ class ReviewBusinessLogic:
                 str(doc.get('updated_at', 'N/A'))
             ])
         total_pages = max(1, (total + page_size - 1) // page_size)
-        return table_data, total_pages, page
+        new_cursor = {
+            'key': list_key,
+            'page': page,
+            'first_id': str(docs[0]['_id']) if docs else None,
+            'last_id': str(docs[-1]['_id']) if docs else None,
+        }
+        return table_data, total_pages, page, new_cursor
+
+    def _cached_count(self, query: Dict[str, Any]) -> int:
+        """带短时缓存的计数，避免每次翻页都做全量 count"""
+        key = json.dumps(query, sort_keys=True, default=str)
+        total = self._count_cache.get(key)
+        if total is None:
+            total = self.db.estimated_count(query)
+            self._count_cache.set(key, total)
+        return total
 
-    def load_task_for_review(self, task_id: str) -> Tuple:
+    def load_task_images(self, task_id: str, full_resolution: bool = False):
+        """按需加载任务图像（缩略图或原图）"""
+        if not task_id:
+            return None, None
+        task = self.db.get_annotation_by_id(task_id)
+        if not task:
+            return None, None
+        return open_task_images(task, full_resolution)
+
+    def load_task_for_review(self, task_id: str, full_resolution: bool = False) -> Tuple:
         """加载任务详情用于审查"""
         task = self.db.get_annotation_by_id(task_id)
         if not task:
             default_opts = {a: opts[0] for a, opts in self.annotation_options.items()}
             return None, None, f"任务 {task_id} 不存在", default_opts, "", f"任务 {task_id} 不存在"
 
-        lq_pil = open_image(task['lq_image_path'])
-        hq_pil = open_image(task['hq_image_path'])
+        lq_pil, hq_pil = open_task_images(task, full_resolution)
         user_id = task.get('last_updated_by', '')
-        if user_id:
-            use_name = self.db.get_user_by_id(user_id).username
-        else:
-            use_name = 'Unkown'
+        user_doc = self.db.get_user_by_id(user_id) if user_id else None
+        use_name = user_doc.username if user_doc else 'Unkown'
         current_annotations = task.get('annotations', {})
         selected_options = {
             angle: current_annotations.get(angle, options["value"])
@@ -84,8 +131,12 @@ class ReviewBusinessLogic:
         except Exception as e:
             return f"更新任务时出错: {str(e)}"
     
-    def generate_text_with_llm(self, selected_options: Dict[str, str], lq_image, hq_image):
-        return generate_text(selected_options, lq_image, hq_image)
+    def get_tag(self, task_id: str) -> str:
+        task = self.db.get_annotation_by_id(task_id) if task_id else None
+        return task.get('tag', '') if task else ''
+
+    async def generate_text_with_llm(self, selected_options: Dict[str, str], lq_image, hq_image, tag) -> str:
+        return await generate_text(selected_options, lq_image, hq_image, tag)
 
     def export_data_for_download(self, query_str: str) -> str:
         """导出数据"""
@@ -97,10 +148,12 @@ class ReviewBusinessLogic:
         except Exception as e:
             return None, f"导出失败: {e}"
 
-    def import_data(self, file_path: str) -> str:
+    def import_data(self, file_path: str, overwrite: bool = False) -> str:
         """导入数据"""
         try:
-            count = self.db.import_annotations_from_json(file_path)
-            return f"成功导入 {count} 条数据"
+            stats = self.db.import_annotations_from_json(file_path, on_duplicate="upsert" if overwrite else "skip")
+            self._count_cache.clear()
+            return (f"读取 {stats['records']} 条数据：新增 {stats['inserted']}，覆盖 {stats['updated']}，"
+                    f"跳过 {stats['skipped']}，失败 {stats['failed']}，格式错误 {stats['errors']}")
         except Exception as e:
             return f"导入失败: {e}"
\ No newline at end of file
@@ -1,29 +1,73 @@
+import threading
+import logging
 from typing import Optional, Dict, Any, List
 from .connection import MongoConnection
 from .annotation_repository import AnnotationRepository
 from .user_repository import UserRepository
 from .user_history_repository import UserHistoryRepository
+from .counter_repository import CounterRepository
+from .lease_reaper import LeaseReaper
+from .command_monitor import CommandTracker
+from .indexes import (build_index_manifest, ensure_indexes, hot_queries, explain_query,
+                      OBSOLETE_ANNOTATION_INDEXES)
 from model import User
+from config import OPTIONS
+from utils.metrics import instrument_methods
 
+logger = logging.getLogger(__name__)
+
+# 后台初始化失败（如服务暂不可用）后的重试间隔（秒）
+BOOTSTRAP_RETRY_SECONDS = 30
+
+@instrument_methods("annotation_db_operation", "operation")
 class Database:
     def __init__(self, mongodb_uri="mongodb://localhost:27017/", db_name="annotation_db",
-                 collection_name="annotations", lock_collection_name="annotation_locks",
-                 use_collection_name="users", user_history_collection_name="user_task_history"):
-        
-        self.conn = MongoConnection(mongodb_uri, db_name)
+                 collection_name="annotations", use_collection_name="users", user_history_collection_name="user_task_history",
+                 counter_collection_name=None, meta_collection_name="schema_meta",
+                 reaper_interval=30, reaper_batch_size=500,
+                 command_monitoring=False, slow_command_ms=100,
+                 max_pool_size=100, min_pool_size=0, server_selection_timeout_ms=30000,
+                 connect_timeout_ms=20000, socket_timeout_ms=None, compressors=None,
+                 read_preference="primary", background_bootstrap=True):
+        """
+        构造时不做任何网络请求：客户端惰性连接，索引清单与旧数据迁移由 ensure_schema 执行，
+        默认在后台线程中进行。服务不可用时启动不会阻塞，由首个请求报错。
+
+        Args:
+            max_pool_size / min_pool_size: 连接池大小
+            server_selection_timeout_ms / connect_timeout_ms / socket_timeout_ms: 超时（毫秒），None 为不限制
+            compressors: 网络压缩算法列表，如 ["zstd", "snappy"]
+            read_preference: 审查列表与导出等只读路径使用的读偏好，如 "secondaryPreferred"
+            background_bootstrap: 是否在后台线程中执行 ensure_schema（失败时定期重试）；
+                                  为 False 时由调用方在写入前自行调用 ensure_schema
+        """
         
-        # 创建索引配置
-        index_config = {
-            collection_name: ["status", "assigned_user", "assigned_at"],
-            lock_collection_name: [{"keys": "doc_id", "unique": True}, "expires_at"],
-            use_collection_name: ["username", "user_id"],
-            user_history_collection_name: ["user_id"]
-        }
-        self.conn.create_indexes(index_config)
+        # 命令监控为可选项：把每条命令归属到触发它的界面操作
+        self.command_tracker = CommandTracker(slow_command_ms) if command_monitoring else None
+        self.conn = MongoConnection(
+            mongodb_uri, db_name,
+            event_listeners=[self.command_tracker] if self.command_tracker else None,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            connectTimeoutMS=connect_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms,
+            compressors=compressors or None,
+        )
+        self._index_manifest = build_index_manifest(collection_name, use_collection_name, user_history_collection_name)
+        self._meta_collection_name = meta_collection_name
+        self._obsolete_indexes = {collection_name: OBSOLETE_ANNOTATION_INDEXES}
+        self._user_history_collection_name = user_history_collection_name
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._closed = threading.Event()
 
         # 初始化子模块
+        self.counters = CounterRepository(
+            self.conn, counter_collection_name or f"{collection_name}_counters"
+        )
         self.annotations = AnnotationRepository(
-            self.conn, collection_name, lock_collection_name
+            self.conn, collection_name, self.counters, read_preference=read_preference
         )
         self.user = UserRepository(
             self.conn, use_collection_name
@@ -31,32 +75,93 @@ class Database:
         self.user_history = UserHistoryRepository(
             self.conn, user_history_collection_name
         )
+        self.lease_reaper = LeaseReaper(
+            self.annotations, self.user_history,
+            interval=reaper_interval, batch_size=reaper_batch_size
+        )
+        if background_bootstrap:
+            threading.Thread(target=self._bootstrap_in_background, name="db-bootstrap", daemon=True).start()
 
-    def initialize(self, annotation_pairs, tag_name):
-        return self.annotations.initialize_annotations(annotation_pairs, tag_name)
+    def ensure_schema(self):
+        """
+        检查连接并按版本应用索引清单，历史集合版本变化时迁移旧版历史记录。
+        版本未变化时只有 ping 与一次版本查询；成功后不再执行，失败时抛出异常，下次调用会重试
+        """
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            self.conn.ping()
+            updated_collections = ensure_indexes(
+                self.conn, self._index_manifest, self._meta_collection_name,
+                obsolete=self._obsolete_indexes
+            )
+            if self._user_history_collection_name in updated_collections:
+                # 旧版历史记录的迁移只需在历史集合的结构版本变化时执行一次
+                self.user_history.migrate_legacy_histories()
+            self._schema_ready = True
+
+    def _bootstrap_in_background(self):
+        while not self._closed.is_set():
+            try:
+                self.ensure_schema()
+                return
+            except Exception as e:
+                if self._closed.is_set():
+                    return
+                logger.warning(f"数据库初始化失败，{BOOTSTRAP_RETRY_SECONDS} 秒后重试: {e}")
+                self._closed.wait(BOOTSTRAP_RETRY_SECONDS)
+
+    def initialize(self, annotation_pairs, tag_name, chunk_size=1000):
+        return self.annotations.initialize_annotations(annotation_pairs, tag_name, chunk_size)
+
+    ### lease reaper ###
+    def start_lease_reaper(self):
+        self.lease_reaper.start()
+
+    def stop_lease_reaper(self):
+        self.lease_reaper.stop()
+
+    def reap_expired_leases(self) -> int:
+        return self.lease_reaper.run_once()
+
+    def get_lease_reaper_stats(self) -> Dict[str, Any]:
+        return self.lease_reaper.get_stats()
+
+    def explain_hot_queries(self) -> Dict[str, Dict[str, Any]]:
+        """对标注集合上的热点查询执行 explain，结果中 collscan 为 True 表示缺少可用索引"""
+        return {
+            q["name"]: explain_query(self.annotations.collection, q["filter"], q.get("sort"), q.get("limit"))
+            for q in hot_queries(self.annotations.lock_timeout)
+        }
 
-    def _cleanup_expired_locks(self):
-        num_expired_doc, expired_doc_ids = self.annotations.cleanup_expired_locks()
-        if num_expired_doc>0:
-            self.user_history.cleanup_user_histories_for_expired_tasks(expired_doc_ids)
+    def get_command_report(self) -> Dict[str, Any]:
+        """按界面操作汇总的 MongoDB 命令报告，未开启命令监控时为空"""
+        return self.command_tracker.report() if self.command_tracker else {}
 
     def get_annotation_by_id(self, doc_id: str) -> Optional[Dict[str, Any]]:
-        self._cleanup_expired_locks()
         return self.annotations.get_by_id(doc_id)
 
-    def get_next_pending_annotation(self, user_id: str) -> Optional[Dict[str, Any]]:
-        self._cleanup_expired_locks()
-        return self.annotations.get_next_pending(user_id)
+    def get_next_pending_annotation(self, user_id: str, lease_seconds: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        return self.annotations.get_next_pending(user_id, lease_seconds)
 
     def release_annotation_lock(self, doc_id: str, user_id: str) -> bool:
         return self.annotations.release_lock_and_reset(doc_id, user_id)
 
+    def renew_annotation_lease(self, doc_id: str, user_id: str) -> bool:
+        return self.annotations.renew_lease(doc_id, user_id)
+
     def update_annotation_by_id(self, doc_id: str, annotations: Dict[str, Any], user_edited_text: str, status: str) -> bool:
         return self.annotations.update_by_id(doc_id, annotations, user_edited_text, status)
     
     def update_user_edited_text(self, doc_id: str, text: str) -> bool:
         return self.annotations.update_user_edited_text(doc_id, text)
 
+    def find_pending_without_text(self, limit: int, after_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.annotations.find_pending_without_text(limit, after_id)
+
+    def set_generated_texts(self, texts: Dict[str, str]) -> int:
+        return self.annotations.set_generated_texts(texts)
+
     def update_annotation_with_lock(self, doc_id: str, user_id: str, 
                                     annotations: Dict[str, Any], 
                                     user_edited_text: str = "", 
@@ -65,60 +170,68 @@ class Database:
 
     def get_annotation_statistics(self) -> Dict[str, int]:
         return self.annotations.get_statistics()
+
+    def recompute_annotation_statistics(self) -> Dict[str, Any]:
+        return self.annotations.recompute_statistics()
     
-    def find_with_pagination(self, query: dict, skip: int, limit: int):
-        return self.annotations.find_with_pagination(query, skip, limit)
+    def find_with_pagination(self, query: dict, skip: int, limit: int, projection: Optional[dict] = None):
+        return self.annotations.find_with_pagination(query, skip, limit, projection)
+
+    def find_page_by_key(self, query: dict, limit: int, after_id: Optional[str] = None,
+                         before_id: Optional[str] = None, projection: Optional[dict] = None):
+        return self.annotations.find_page_by_key(query, limit, after_id, before_id, projection)
     
     def export_to_csv_for_download(self, query):
+        """
+        流式导出为CSV
+
+        表头由服务端汇总出的 metadata 与 annotations 字段（以及 OPTIONS 中的评分维度）预先确定，
+        用户通过一次批量查询预取，随后边遍历游标边写入，内存占用与数据量无关。
+        """
         import tempfile
         import csv
         import json
         try:
             # 解析查询
-            query = json.loads(query) if query.strip() else {}
-            cursor = self.annotations.collection.find(query)
-            rows = []
-            all_fieldnames = set()
-            for doc in cursor:
-                # 提取基础字段
-                base_fields = {
-                    "_id": str(doc.get("_id", "")),
-                    "last_updated_by": "",
-                    "status": doc.get("status", ""),
-                    "tag": doc.get("tag", ""),
-                    "updated_at": doc.get("updated_at", ""),
-                    "user_edited_text": doc.get("user_edited_text", ""),
-                }
-                user_id = doc.get("last_updated_by")
-                if user_id:
-                    user = self.get_user_by_id(user_id)
-                    base_fields["last_updated_by"] = user.username if user else f"unknown({user_id})"
-                else:
-                    base_fields["last_updated_by"] = "N/A"
-                meta = doc.get("metadata", {})
-                anno = doc.get("annotations", {})
-                flat_meta = {f"metadata.{k}": v for k, v in meta.items()}
-                flat_anno = {f"annotations.{k}": v for k, v in anno.items()}
-                row = {**base_fields, **flat_meta, **flat_anno}
-                all_fieldnames.update(row.keys())
-                rows.append(row)
-            
-            temp_file = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8-sig', newline='')
-            if rows:
-                fieldnames = sorted(list(all_fieldnames))
-                writer = csv.DictWriter(temp_file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(rows)
-            else:
-                # 空结果也写表头
-                writer = csv.DictWriter(temp_file, fieldnames=[
-                    "_id", "status", "method_name", "image_name", "tag",
-                    "last_updated_by", "updated_at", "user_edited_text", "revision_advice"
-                ])
+            if isinstance(query, str):
+                query = json.loads(query) if query.strip() else {}
+            query = query or {}
+
+            users = self.get_users_by_ids(self.annotations.distinct_updaters(query))
+            meta_keys = self.annotations.get_metadata_keys(query)
+            annotation_keys = set(self.annotations.get_subdocument_keys("annotations", query)) | set(OPTIONS)
+            fieldnames = sorted(
+                ["_id", "last_updated_by", "status", "tag", "updated_at", "user_edited_text"]
+                + [f"metadata.{k}" for k in meta_keys]
+                + [f"annotations.{k}" for k in annotation_keys]
+            )
+
+            count = 0
+            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8-sig', newline='') as temp_file:
+                writer = csv.DictWriter(temp_file, fieldnames=fieldnames, restval="", extrasaction="ignore")
                 writer.writeheader()
-            temp_file.close()
+                for doc in self.annotations.find_for_export(query):
+                    user_id = doc.get("last_updated_by")
+                    if user_id:
+                        username = users[user_id].username if user_id in users else f"unknown({user_id})"
+                    else:
+                        username = "N/A"
+                    row = {
+                        "_id": str(doc.get("_id", "")),
+                        "last_updated_by": username,
+                        "status": doc.get("status", ""),
+                        "tag": doc.get("tag", ""),
+                        "updated_at": doc.get("updated_at", ""),
+                        "user_edited_text": doc.get("user_edited_text", ""),
+                    }
+                    for k, v in (doc.get("metadata") or {}).items():
+                        row[f"metadata.{k}"] = v
+                    for k, v in (doc.get("annotations") or {}).items():
+                        row[f"annotations.{k}"] = v
+                    writer.writerow(row)
+                    count += 1
 
-            return temp_file.name, f"成功导出 {len(rows)} 条数据"
+            return temp_file.name, f"成功导出 {count} 条数据"
     
         except Exception as e:
             temp_err = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8', newline='')
@@ -128,8 +241,9 @@ class Database:
             temp_err.close()
             return temp_err.name, f"导出失败: {e}"
 
-    def import_annotations_from_json(self, file_path):
-        return self.annotations.import_from_json(file_path)
+    def import_annotations_from_json(self, file_path, batch_size: int = 1000, on_duplicate: str = "skip",
+                                     progress_callback=None) -> Dict[str, int]:
+        return self.annotations.import_from_json(file_path, batch_size, on_duplicate, progress_callback)
 
     def find_all(self, query):
         return self.annotations.find_all(query)
@@ -137,6 +251,9 @@ class Database:
     def count(self, query):
         return self.annotations.count(query)
 
+    def estimated_count(self, query):
+        return self.annotations.estimated_count(query)
+
     ### user ###
     def register_user(self, username: str) -> Optional[User]:
         return self.user.register_user(username)
@@ -146,23 +263,33 @@ class Database:
     
     def get_user_by_id(self, user_id: str) -> Optional[User]:
         return self.user.get_user_by_id(user_id)
+
+    def get_users_by_ids(self, user_ids) -> Dict[str, User]:
+        return self.user.get_users_by_ids(user_ids)
     
     ### user history ###
     def add_task_to_user_history(self, user_id: str, task: Dict[str, Any]) -> bool:
         return self.user_history.add_task(user_id, task)
 
-    def get_user_task_history(self, user_id: str) -> List[Dict[str, Any]]:
-        return self.user_history.get_history(user_id)
+    def get_user_history_position(self, user_id: str) -> Dict[str, Any]:
+        return self.user_history.get_position(user_id)
 
-    def get_user_current_history_index(self, user_id: str) -> int:
-        return self.user_history.get_current_index(user_id)
+    def peek_user_history_next(self, user_id: str) -> Optional[str]:
+        return self.user_history.peek_next_task_id(user_id)
+
+    def move_user_history(self, user_id: str, delta: int) -> Optional[Dict[str, Any]]:
+        return self.user_history.move_current_index(user_id, delta)
 
-    def update_user_current_history_index(self, user_id: str, index: int) -> bool:
-        return self.user_history.update_current_index(user_id, index)
+    def remove_task_from_user_history(self, user_id: str, doc_id: str) -> bool:
+        return self.user_history.remove_task(user_id, doc_id)
 
-    def update_history(self, user_id: str, history: List[Dict]) -> bool:
-        return self.user_history.update_history(user_id, history)
+    def get_user_current_history_index(self, user_id: str) -> int:
+        return self.user_history.get_current_index(user_id)
     
     def close_connection(self):
+        self._closed.set()
+        self.lease_reaper.stop()
+        if self.command_tracker:
+            self.command_tracker.close()
         self.conn.close()
     
@@ -1,133 +1,176 @@
-import json
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Any, List
 from bson import ObjectId
+from bson.errors import InvalidId
 import logging
-from pymongo.errors import DuplicateKeyError
+from pymongo import ReturnDocument, UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+from .counter_repository import ALL_STATUSES
+from utils.json_stream import iter_json_records
+
+# 重复组字段：对已存在的代表数据也需要写入
+DUP_FIELDS = ("dup_group", "dup_representative")
+
+# 导入时只对这些字段做时间类型转换
+DATETIME_FIELDS = ("created_at", "updated_at", "assigned_at", "lease_expires_at", "generated_at")
+
+def _parse_datetime(value):
+    if isinstance(value, dict) and "$date" in value:
+        value = value["$date"]
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+def _coerce_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将导出文件中的 _id 与时间字段还原为 ObjectId 与 datetime
+
+    Raises:
+        ValueError / TypeError / InvalidId: 数据不是对象，或 _id、时间字段格式错误
+    """
+    if not isinstance(record, dict):
+        raise TypeError(f"数据应为 JSON 对象，实际为 {type(record).__name__}")
+    _id = record.get("_id")
+    if isinstance(_id, dict) and "$oid" in _id:
+        record["_id"] = ObjectId(_id["$oid"])
+    elif isinstance(_id, str) and ObjectId.is_valid(_id):
+        record["_id"] = ObjectId(_id)
+    for field in DATETIME_FIELDS:
+        if record.get(field) is not None:
+            record[field] = _parse_datetime(record[field])
+    return record
 
 logger = logging.getLogger(__name__)
 
 class AnnotationRepository:
-    def __init__(self, connection, collection_name: str, lock_collection_name: str, lock_timeout: int = 300):
+    def __init__(self, connection, collection_name: str, counters, lock_timeout: int = 300,
+                 read_preference: str = "primary"):
         self.conn = connection
         self.collection = connection.get_collection(collection_name)
-        self.lock_collection = connection.get_collection(lock_collection_name)
+        # 审查列表、导出等只读查询可以使用单独的读偏好（例如读从节点）
+        self.read_collection = connection.get_collection(collection_name, read_preference)
+        self.counters = counters
         self.lock_timeout = lock_timeout
     
-    def initialize_annotations(self, annotation_pairs: List[Dict[str, Any]], tag_name:str) -> dict:
+    def initialize_annotations(self, annotation_pairs: List[Dict[str, Any]], tag_name: str,
+                               chunk_size: int = 1000) -> dict:
+        """
+        批量初始化标注数据
+
+        按 chunk_size 分块发送无序 upsert，重复判定依赖
+        (lq_image_path, hq_image_path, metadata.method_name) 上的唯一索引，在服务端完成。
+
+        Args:
+            annotation_pairs: 标注数据对列表
+            tag_name: 作为标签的 meta_data 字段名
+            chunk_size: 每个批次的 upsert 数量
+
+        Returns:
+            dict: 总插入数、总跳过数以及每个批次的统计
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size 必须为正整数: {chunk_size}")
         inserted = 0
         skipped = 0
+        chunks = []
+        new_duplicate_groups = set()
 
-        for pair in annotation_pairs:
-            metadata = {
-                'method_name': pair['method_name'],
-                'image_name': pair['image_name'],
-            }
-            metadata.update(pair['meta_data'])
-            annotation_doc = {
-                'lq_image_path': pair['lq_image_path'],
-                'hq_image_path': pair['hq_image_path'],
-                'tag': pair['meta_data'][tag_name],
-                'metadata': metadata,
-                'annotations': {},
-                'user_edited_text': '',
-                'status': 'pending',
-                'assigned_user': None,
-                'assigned_at': None,
-                'updated_at': None,
-                'last_updated_by': None
-            }
+        for start in range(0, len(annotation_pairs), chunk_size):
+            chunk = annotation_pairs[start:start + chunk_size]
+            operations = [self._build_upsert(pair, tag_name) for pair in chunk]
 
-            query = {
-                'lq_image_path': annotation_doc['lq_image_path'],
-                'hq_image_path': annotation_doc['hq_image_path'],
-                'metadata.method_name': annotation_doc['metadata']['method_name'],
-            }
+            try:
+                result = self.collection.bulk_write(operations, ordered=False)
+                upserted_indexes = list(result.upserted_ids.keys())
+            except BulkWriteError as e:
+                # 并发导入时唯一索引冲突视为已存在，其余错误继续抛出
+                details = e.details
+                if any(err.get('code') != 11000 for err in details.get('writeErrors', [])):
+                    logger.error(f"批量初始化标注数据时出错: {details.get('writeErrors')}")
+                    raise
+                upserted_indexes = [item['index'] for item in details.get('upserted', [])]
 
-            result = self.collection.update_one(
-                query,
-                {"$setOnInsert": annotation_doc},
-                upsert=True
+            chunk_inserted = len(upserted_indexes)
+            new_duplicate_groups.update(chunk[i]['meta_data']['dup_group'] for i in upserted_indexes
+                                        if chunk[i].get('status') == 'duplicate')
+            self.counters.record_transitions(
+                (None, chunk[i].get('status', 'pending'), chunk[i]['meta_data'][tag_name], chunk[i]['method_name'], 1)
+                for i in upserted_indexes
             )
 
-            if result.upserted_id:
-                inserted += 1
-            else:
-                skipped += 1
+            chunk_skipped = len(chunk) - chunk_inserted
+            inserted += chunk_inserted
+            skipped += chunk_skipped
+            chunks.append({'offset': start, 'inserted': chunk_inserted, 'skipped': chunk_skipped})
+            logger.info(f"批次 {start}-{start + len(chunk)}: 插入 {chunk_inserted}，跳过 {chunk_skipped}")
 
-        return {'inserted': inserted, 'skipped': skipped}
+        if new_duplicate_groups:
+            self._sync_new_duplicates(new_duplicate_groups)
 
-    def _acquire_lock(self, doc_id: str, user_id: str) -> bool:
-        """
-        获取分布式锁
-        
-        Args:
-            doc_id: 文档ID
-            user_id: 用户ID
-            
-        Returns:
-            bool: 锁获取是否成功
-        """
-        try:
-            expires_at = datetime.now() + timedelta(seconds=self.lock_timeout)
-            
-            # 尝试插入锁记录
-            lock_doc = {
-                "doc_id": doc_id,
-                "user_id": user_id,
-                "acquired_at": datetime.now(),
-                "expires_at": expires_at
-            }
-            
-            try:
-                self.lock_collection.insert_one(lock_doc)
-                print(f"用户 {user_id} 成功获取文档 {doc_id} 的锁")
-                logger.info(f"用户 {user_id} 成功获取文档 {doc_id} 的锁")
-                return True
-            except DuplicateKeyError:
-                # 锁已被其他用户获取，检查是否过期
-                existing_lock = self.lock_collection.find_one({"doc_id": doc_id})
-                if existing_lock and existing_lock["expires_at"] < datetime.now():
-                    # 锁已过期，删除旧锁并重新获取
-                    self.lock_collection.delete_one({"doc_id": doc_id})
-                    self.lock_collection.insert_one(lock_doc)
-                    logger.info(f"用户 {user_id} 获取了过期的文档 {doc_id} 锁")
-                    return True
-                else:
-                    logger.info(f"用户 {user_id} 获取文档 {doc_id} 锁失败")
-                    return False
-                    
-        except Exception as e:
-            logger.error(f"获取锁时出错: {e}")
-            return False
+        return {'inserted': inserted, 'skipped': skipped, 'chunks': chunks}
 
-    def _release_lock(self, doc_id: str, user_id: str) -> bool:
+    def _sync_new_duplicates(self, dup_groups) -> int:
         """
-        释放分布式锁
-        
-        Args:
-            doc_id: 文档ID
-            user_id: 用户ID
-            
+        新插入的重复数据所属的代表已经标注完成时（例如新增方法后重新导入），
+        立即把代表的标注结果同步过来，否则这些数据既不会被领取也不会再收到结果
+
         Returns:
-            bool: 锁释放是否成功
+            int: 同步的数据数量
         """
-        try:
-            result = self.lock_collection.delete_one({
-                "doc_id": doc_id,
-                "user_id": user_id
-            })
-            
-            if result.deleted_count > 0:
-                logger.info(f"用户 {user_id} 成功释放文档 {doc_id} 的锁")
-                return True
-            else:
-                logger.warning(f"用户 {user_id} 未能释放文档 {doc_id} 的锁")
-                return False
-                
-        except Exception as e:
-            logger.error(f"释放锁时出错: {e}")
-            return False
+        synced = 0
+        representatives = self.collection.find(
+            {"metadata.dup_group": {"$in": list(dup_groups)}, "metadata.dup_representative": True,
+             "status": {"$in": ["annotated", "reviewed"]}},
+            {"status": 1, "annotations": 1, "user_edited_text": 1, "updated_at": 1, "last_updated_by": 1,
+             "metadata.dup_group": 1, "metadata.dup_representative": 1}
+        )
+        for rep in representatives:
+            update_data = {k: rep.get(k) for k in ("annotations", "user_edited_text", "status",
+                                                   "updated_at", "last_updated_by")}
+            synced += self._propagate_to_duplicates(rep["_id"], rep, update_data)
+        return synced
+
+    def _build_upsert(self, pair: Dict[str, Any], tag_name: str) -> UpdateOne:
+        metadata = {
+            'method_name': pair['method_name'],
+            'image_name': pair['image_name'],
+        }
+        metadata.update(pair['meta_data'])
+        annotation_doc = {
+            'lq_image_path': pair['lq_image_path'],
+            'hq_image_path': pair['hq_image_path'],
+            'tag': pair['meta_data'][tag_name],
+            'metadata': metadata,
+            'annotations': {},
+            'user_edited_text': '',
+            'status': pair.get('status', 'pending'),
+            'assigned_user': None,
+            'assigned_at': None,
+            'lease_expires_at': None,
+            'updated_at': None,
+            'last_updated_by': None
+        }
+
+        query = {
+            'lq_image_path': annotation_doc['lq_image_path'],
+            'hq_image_path': annotation_doc['hq_image_path'],
+            'metadata.method_name': annotation_doc['metadata']['method_name'],
+        }
+        update = {"$setOnInsert": annotation_doc}
+        to_set = {}
+        if pair.get('renditions'):
+            # 缩略图信息对已存在的数据也进行补充
+            to_set['renditions'] = pair['renditions']
+        if metadata.get('dup_representative'):
+            # 重复组的代表可能是之前导入、已存在的数据，组信息需要写入，
+            # 否则代表标注完成后不会同步到新导入的重复数据；非代表的已有数据保持独立
+            annotation_doc.pop('metadata')
+            for key, value in metadata.items():
+                target = to_set if key in DUP_FIELDS else annotation_doc
+                target[f'metadata.{key}'] = value
+        if to_set:
+            update["$set"] = to_set
+        return UpdateOne(query, update, upsert=True)
 
     def get_by_id(self, doc_id: str) -> Optional[Dict]:
         try:
@@ -145,57 +188,77 @@ class AnnotationRepository:
             logger.error(f"查询数据时出错: {e}")
             raise
 
-    def get_next_pending(self, user_id: str) -> Optional[Dict]:
+    def get_next_pending(self, user_id: str, lease_seconds: Optional[int] = None) -> Optional[Dict]:
         """
-        获取下一个待标注的数据（带锁机制）
-        
+        原子地领取下一个待标注的数据
+
+        通过一次 find_one_and_update 在服务端完成“查找 pending + 标记为 annotating”，
+        租约（assigned_user / assigned_at / lease_expires_at）直接记录在标注文档上，
+        并发领取时由服务端保证同一文档只会被一个用户拿到。
+
         Args:
             user_id: 用户ID
-            
+            lease_seconds: 租约时长，默认为 lock_timeout（预领取时使用更短的租约）
+
         Returns:
-            Optional[Dict]: 标注数据字典，如果没有则返回None
+            Optional[Dict]: 更新后的标注数据字典，如果没有则返回None
         """
         try:
-            # 查找状态为pending的数据
-            pending_docs = self.collection.find({"status": "pending"}).sort("_id", 1)
-            
-            for doc in pending_docs:
-                doc_id = str(doc['_id'])
-                
-                # 尝试获取锁
-                if self._acquire_lock(doc_id, user_id):
-                    # 成功获取锁，更新文档状态
-                    now = datetime.now()
-                    result = self.collection.update_one(
-                        {"_id": doc["_id"]},
-                        {
-                            "$set": {
-                                "status": "annotating",
-                                "assigned_user": user_id,
-                                "assigned_at": now,
-                                "updated_at": now
-                            }
-                        }
-                    )
-                    
-                    if result.modified_count > 0:
-                        # 返回更新后的文档
-                        updated_doc = self.collection.find_one({"_id": doc["_id"]})
-                        updated_doc['_id'] = str(updated_doc['_id'])
-                        logger.info(f"用户 {user_id} 成功获取文档 {doc_id} 进行标注")
-                        return updated_doc
-                    else:
-                        # 更新失败，释放锁
-                        self._release_lock(doc_id, user_id)
-                        continue  # 尝试下一个
-                    
-            logger.info(f"用户 {user_id} 未能获取任何待标注任务")
-            return None
-            
+            now = datetime.now()
+            lease_seconds = lease_seconds or self.lock_timeout
+            doc = self.collection.find_one_and_update(
+                {"status": "pending"},
+                {
+                    "$set": {
+                        "status": "annotating",
+                        "assigned_user": user_id,
+                        "assigned_at": now,
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        "updated_at": now
+                    }
+                },
+                sort=[("_id", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+
+            if not doc:
+                logger.info(f"用户 {user_id} 未能获取任何待标注任务")
+                return None
+
+            self.counters.record_transition('pending', 'annotating', doc)
+            doc['_id'] = str(doc['_id'])
+            logger.info(f"用户 {user_id} 成功获取文档 {doc['_id']} 进行标注")
+            return doc
+
         except Exception as e:
             logger.error(f"获取待标注数据时出错: {e}")
             raise
 
+    def renew_lease(self, doc_id: str, user_id: str) -> bool:
+        """
+        续期用户持有的租约（同时校验租约仍属于该用户）
+        
+        Args:
+            doc_id: 文档ID
+            user_id: 用户ID
+            
+        Returns:
+            bool: 租约仍有效并已续期
+        """
+        try:
+            now = datetime.now()
+            result = self.collection.update_one(
+                {"_id": ObjectId(doc_id), "status": "annotating", "assigned_user": user_id},
+                {"$set": {
+                    "assigned_at": now,
+                    "lease_expires_at": now + timedelta(seconds=self.lock_timeout)
+                }}
+            )
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"续期租约时出错: {e}")
+            return False
+
     def update_with_lock(self, doc_id: str, user_id: str,
                         annotations: Optional[Dict[str, float]] = None,
                         user_edited_text: Optional[str] = None,
@@ -216,12 +279,6 @@ class AnnotationRepository:
         try:
             object_id = ObjectId(doc_id)
             
-            # 首先检查当前用户是否拥有该文档的锁
-            lock = self.lock_collection.find_one({"doc_id": doc_id})
-            if not lock or lock.get("user_id") != user_id:
-                logger.warning(f"用户 {user_id} 无权更新文档 {doc_id}")
-                return False
-            
             # 构建更新数据
             update_data = {
                 "updated_at": datetime.now(),
@@ -235,25 +292,27 @@ class AnnotationRepository:
             if status is not None:
                 update_data["status"] = status
             
-            # 如果状态变为annotated，清空分配信息
-            if status == "annotated":
+            # 如果标注完成，清空分配信息（即释放租约）
+            if status in ["annotated", "reviewed"]:
                 update_data["assigned_user"] = None
                 update_data["assigned_at"] = None
+                update_data["lease_expires_at"] = None
             
-            result = self.collection.update_one(
-                {"_id": object_id},
-                {"$set": update_data}
+            # 只有持有租约的用户才能更新
+            before = self.collection.find_one_and_update(
+                {"_id": object_id, "status": "annotating", "assigned_user": user_id},
+                {"$set": update_data},
+                projection={"tag": 1, "metadata.method_name": 1, "metadata.dup_group": 1, "metadata.dup_representative": 1}
             )
             
-            success = result.modified_count > 0
+            success = before is not None
             if success:
+                if status is not None:
+                    self.counters.record_transition('annotating', status, before)
+                self._propagate_to_duplicates(object_id, before, update_data)
                 logger.info(f"用户 {user_id} 成功更新标注数据，ID: {doc_id}")
-                
-                # 如果标注完成，释放锁
-                if status in ["annotated", "reviewed"]:
-                    self._release_lock(doc_id, user_id)
             else:
-                logger.warning(f"用户 {user_id} 未找到要更新的数据，ID: {doc_id}")
+                logger.warning(f"用户 {user_id} 无权更新文档或未找到数据，ID: {doc_id}")
             
             return success
             
@@ -278,13 +337,18 @@ class AnnotationRepository:
             if status is not None:
                 update_data["status"] = status
             
-            result = self.collection.update_one(
+            before = self.collection.find_one_and_update(
                 {"_id": object_id},
-                {"$set": update_data}
+                {"$set": update_data},
+                projection={"status": 1, "tag": 1, "metadata.method_name": 1,
+                            "metadata.dup_group": 1, "metadata.dup_representative": 1}
             )
             
-            success = result.modified_count > 0
+            success = before is not None
             if success:
+                if status is not None:
+                    self.counters.record_transition(before.get('status'), status, before)
+                self._propagate_to_duplicates(object_id, before, update_data)
                 logger.info(f"成功更新标注数据，ID: {doc_id}")
             else:
                 logger.warning(f"未找到要更新的数据，ID: {doc_id}，或数据无变化")
@@ -295,6 +359,43 @@ class AnnotationRepository:
             logger.error(f"更新数据时出错: {e}")
             return False
 
+    def _propagate_to_duplicates(self, object_id: ObjectId, source: Dict[str, Any], update_data: Dict[str, Any]) -> int:
+        """
+        重复组的代表标注完成后，把标注结果同步到组内其余数据
+
+        Args:
+            object_id: 代表数据的ID
+            source: 代表数据更新前的文档（含 metadata.dup_group）
+            update_data: 代表数据本次更新的字段
+
+        Returns:
+            int: 同步的数据数量
+        """
+        metadata = source.get("metadata") or {}
+        if not metadata.get("dup_group") or not metadata.get("dup_representative"):
+            return 0
+        if update_data.get("status") not in ("annotated", "reviewed"):
+            return 0
+
+        fields = {k: update_data[k] for k in ("annotations", "user_edited_text", "status", "updated_at", "last_updated_by")
+                  if k in update_data}
+        fields["dup_source_id"] = str(object_id)
+        member_query = {"metadata.dup_group": metadata["dup_group"], "_id": {"$ne": object_id}}
+        try:
+            members = list(self.collection.find(member_query, {"status": 1, "tag": 1, "metadata.method_name": 1}))
+            if not members:
+                return 0
+            self.collection.update_many({"_id": {"$in": [m["_id"] for m in members]}}, {"$set": fields})
+            self.counters.record_transitions(
+                (m.get("status"), fields["status"], m.get("tag"), (m.get("metadata") or {}).get("method_name"), 1)
+                for m in members
+            )
+            logger.info(f"标注结果已同步到重复组 {metadata['dup_group']} 的 {len(members)} 条数据")
+            return len(members)
+        except Exception as e:
+            logger.error(f"同步重复组标注结果时出错: {e}")
+            return 0
+
     def update_user_edited_text(self, doc_id: str, text: str) -> bool:
         try:
             result = self._collection.update_one(
@@ -311,9 +412,53 @@ class AnnotationRepository:
             print(f"更新 user_edited_text 失败: {e}")
             return False
     
+    def find_pending_without_text(self, limit: int, after_id: Optional[str] = None) -> List[Dict]:
+        """
+        按 _id 顺序获取尚未预生成评价文本的待标注任务
+
+        Args:
+            limit: 数量上限
+            after_id: 只取 _id 大于该值的任务（断点续跑）
+
+        Returns:
+            List[Dict]: 任务列表（只包含生成所需字段）
+        """
+        query = {"status": "pending", "generated_text": {"$in": ["", None]}}
+        if after_id:
+            query["_id"] = {"$gt": ObjectId(after_id)}
+        projection = {"lq_image_path": 1, "hq_image_path": 1, "renditions": 1, "tag": 1, "metadata": 1}
+        return list(self.collection.find(query, projection).sort("_id", 1).limit(limit))
+
+    def set_generated_texts(self, texts: Dict[str, str]) -> int:
+        """
+        批量写回预生成的评价文本，已有文本的任务不会被覆盖
+
+        Args:
+            texts: 任务ID -> 生成文本
+
+        Returns:
+            int: 实际更新的任务数量
+        """
+        if not texts:
+            return 0
+        now = datetime.now()
+        requests = [
+            UpdateOne(
+                {"_id": ObjectId(doc_id), "generated_text": {"$in": ["", None]}},
+                {"$set": {"generated_text": text, "generated_at": now}}
+            )
+            for doc_id, text in texts.items()
+        ]
+        try:
+            result = self.collection.bulk_write(requests, ordered=False)
+            return result.modified_count
+        except BulkWriteError as e:
+            logger.error(f"批量写回生成文本时部分失败: {e.details.get('writeErrors')}")
+            return e.details.get('nModified', 0)
+
     def release_lock_and_reset(self, doc_id: str, user_id: str) -> bool:
         """
-        释放标注任务锁（当用户取消标注时）
+        释放标注任务租约（当用户取消标注时）
         
         Args:
             doc_id: 文档ID
@@ -323,56 +468,43 @@ class AnnotationRepository:
             bool: 释放是否成功
         """
         try:
-            # 释放锁
-            lock_released = self._release_lock(doc_id, user_id)
-            
-            if lock_released:
-                # 重置文档状态为pending
-                result = self.collection.update_one(
-                    {"_id": ObjectId(doc_id)},
-                    {
-                        "$set": {
-                            "status": "pending",
-                            "assigned_user": None,
-                            "assigned_at": None,
-                            "updated_at": datetime.now()
-                        }
+            # 只有持有租约的用户才能释放，重置文档状态为pending
+            before = self.collection.find_one_and_update(
+                {"_id": ObjectId(doc_id), "status": "annotating", "assigned_user": user_id},
+                {
+                    "$set": {
+                        "status": "pending",
+                        "assigned_user": None,
+                        "assigned_at": None,
+                        "lease_expires_at": None,
+                        "updated_at": datetime.now()
                     }
-                )
-                
-                if result.modified_count > 0:
-                    logger.info(f"用户 {user_id} 释放了文档 {doc_id} 的标注任务")
-                    return True
-                else:
-                    logger.warning(f"未能重置文档 {doc_id} 的状态")
-                    return False
+                },
+                projection={"tag": 1, "metadata.method_name": 1}
+            )
+            
+            if before is not None:
+                self.counters.record_transition('annotating', 'pending', before)
+                logger.info(f"用户 {user_id} 释放了文档 {doc_id} 的标注任务")
+                return True
             else:
-                logger.warning(f"用户 {user_id} 未能释放文档 {doc_id} 的锁")
+                logger.warning(f"用户 {user_id} 未能释放文档 {doc_id} 的租约")
                 return False
                 
         except Exception as e:
-            logger.error(f"释放标注锁时出错: {e}")
+            logger.error(f"释放标注租约时出错: {e}")
             return False
 
     def get_statistics(self) -> Dict[str, int]:
+        """读取计数器文档获取按状态的统计，计数器不存在或未初始化时全量重算一次"""
         try:
-            stats = {}
-            
-            # 按状态统计
-            pipeline = [
-                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-            ]
-            
-            results = list(self.collection.aggregate(pipeline))
-            
+            counters = self.counters.get()
+            if counters is None:
+                counters = self.counters.recompute(self.collection)["counters"]
+
             # 初始化所有状态的计数
-            all_statuses = ["pending", "annotating", "annotated"]
-            for status in all_statuses:
-                stats[status] = 0
-            
-            # 填充实际统计结果
-            for result in results:
-                stats[result['_id']] = result['count']
+            stats = {status: 0 for status in ALL_STATUSES}
+            stats.update({k: v for k, v in (counters.get("global") or {}).items() if v})
             
             # 计算总数量
             stats['total'] = sum(stats.values())
@@ -383,88 +515,263 @@ class AnnotationRepository:
         except Exception as e:
             logger.error(f"获取统计信息时出错: {e}")
             raise
+
+    def recompute_statistics(self) -> Dict[str, Any]:
+        """全量重新计算状态计数器，返回计数及偏差"""
+        return self.counters.recompute(self.collection)
     
-    def cleanup_expired_locks(self):
-        """清理过期的锁"""
-        try:
-            now = datetime.now()
-            expired_locks = self.lock_collection.find({"expires_at": {"$lt": now}})
-            expired_doc_ids = [lock["doc_id"] for lock in expired_locks]
+    def cleanup_expired_locks(self, batch_size: int = 500):
+        """
+        清理租约已过期的任务（每次最多处理 batch_size 条）
 
-            if not expired_doc_ids:
-                return 0, expired_doc_ids
-            
-            self.lock_collection.delete_many({"expires_at": {"$lt": now}})
-            object_ids = [ObjectId(doc_id) for doc_id in expired_doc_ids]
+        先取出一批过期任务的ID，再以带过期条件的 update_many 重置状态，并打上本轮的
+        reap_token，最后按 reap_token 取回真正被重置的ID，避免把刚被重新领取的任务
+        误当作过期任务处理。
 
-            self.collection.update_many(
-                {"_id": {"$in": object_ids}, "status": "annotating"},
-                {
-                    "$set": {
-                        "status": "pending",
-                        "assigned_user": None,
-                        "assigned_at": None,
-                        "updated_at": now
-                    }
+        Args:
+            batch_size: 单批次最多处理的任务数量
+
+        Returns:
+            Tuple[int, List[str]]: 被重置的任务数量及其ID列表
+
+        Raises:
+            Exception: 数据库错误直接抛出，由租约回收线程计入错误统计
+        """
+        now = datetime.now()
+        expired_query = {
+            "status": "annotating",
+            "$or": [
+                {"lease_expires_at": {"$lt": now}},
+                # 兼容旧版本领取、未记录 lease_expires_at 的任务
+                {"lease_expires_at": {"$exists": False},
+                 "assigned_at": {"$lt": now - timedelta(seconds=self.lock_timeout)}}
+            ]
+        }
+        candidates = self.collection.find(expired_query, {"_id": 1}).limit(batch_size)
+        object_ids = [doc["_id"] for doc in candidates]
+
+        if not object_ids:
+            return 0, []
+
+        reap_token = ObjectId()
+        self.collection.update_many(
+            {"_id": {"$in": object_ids}, **expired_query},
+            {
+                "$set": {
+                    "status": "pending",
+                    "assigned_user": None,
+                    "assigned_at": None,
+                    "lease_expires_at": None,
+                    "reap_token": reap_token,
+                    "updated_at": now
                 }
+            }
+        )
+        # 取回真正被重置的任务，同时按标签/方法分组用于更新计数器
+        reaped_groups = self.collection.aggregate([
+            {"$match": {"_id": {"$in": object_ids}, "reap_token": reap_token}},
+            {"$group": {
+                "_id": {"tag": "$tag", "method": "$metadata.method_name"},
+                "ids": {"$push": "$_id"}
+            }}
+        ])
+        expired_doc_ids = []
+        transitions = []
+        for group in reaped_groups:
+            expired_doc_ids.extend(str(oid) for oid in group["ids"])
+            transitions.append(('annotating', 'pending', group["_id"].get("tag"),
+                                group["_id"].get("method"), len(group["ids"])))
+        self.counters.record_transitions(transitions)
+        # reap_token 只用于本轮取回，取回后移除
+        try:
+            self.collection.update_many(
+                {"_id": {"$in": object_ids}, "reap_token": reap_token},
+                {"$unset": {"reap_token": ""}}
             )
-            logger.info(f"清理了 {len(expired_doc_ids)} 个过期锁及对应任务")
-            
-            return len(expired_doc_ids), expired_doc_ids
-            
         except Exception as e:
-            logger.error(f"清理过期锁时出错: {e}")
-            return 0, []
-    
-    def find_with_pagination(self, query: dict, skip: int, limit: int):
-        return list(self.collection.find(query).skip(skip).limit(limit))
+            logger.warning(f"移除 reap_token 时出错: {e}")
+        logger.info(f"清理了 {len(expired_doc_ids)} 个过期租约及对应任务")
+        
+        return len(expired_doc_ids), expired_doc_ids
+
+    def find_with_pagination(self, query: dict, skip: int, limit: int, projection: Optional[dict] = None):
+        return list(self.read_collection.find(query, projection).sort("_id", 1).skip(skip).limit(limit))
+
+    def find_page_by_key(self, query: dict, limit: int,
+                         after_id: Optional[str] = None, before_id: Optional[str] = None,
+                         projection: Optional[dict] = None) -> List[Dict]:
+        """
+        基于 _id 范围的键集分页
+
+        Args:
+            query: 查询条件
+            limit: 每页数量
+            after_id: 取 _id 大于该值的下一页
+            before_id: 取 _id 小于该值的上一页
+            projection: 返回字段
+
+        Returns:
+            List[Dict]: 按 _id 升序排列的一页数据
+        """
+        if after_id:
+            query = {"$and": [query, {"_id": {"$gt": ObjectId(after_id)}}]}
+            return list(self.read_collection.find(query, projection).sort("_id", 1).limit(limit))
+        if before_id:
+            query = {"$and": [query, {"_id": {"$lt": ObjectId(before_id)}}]}
+            docs = list(self.read_collection.find(query, projection).sort("_id", -1).limit(limit))
+            docs.reverse()
+            return docs
+        return list(self.read_collection.find(query, projection).sort("_id", 1).limit(limit))
     
+    def get_metadata_keys(self, query: dict) -> List[str]:
+        """在服务端汇总满足查询条件的文档中出现过的 metadata 字段名"""
+        return self.get_subdocument_keys("metadata", query)
+
+    def get_subdocument_keys(self, field: str, query: dict) -> List[str]:
+        """在服务端汇总满足查询条件的文档中，子文档 field 里出现过的字段名"""
+        pipeline = [
+            {"$match": query},
+            {"$project": {"keys": {"$map": {
+                "input": {"$objectToArray": {"$ifNull": [f"${field}", {}]}},
+                "in": "$$this.k"
+            }}}},
+            {"$unwind": "$keys"},
+            {"$group": {"_id": "$keys"}}
+        ]
+        return sorted(doc["_id"] for doc in self.read_collection.aggregate(pipeline))
+
+    def distinct_updaters(self, query: dict) -> List[str]:
+        return [uid for uid in self.read_collection.distinct("last_updated_by", query) if uid]
+
+    def find_for_export(self, query: dict, batch_size: int = 1000):
+        projection = {
+            "last_updated_by": 1, "status": 1, "tag": 1, "updated_at": 1,
+            "user_edited_text": 1, "metadata": 1, "annotations": 1
+        }
+        return self.read_collection.find(query, projection).batch_size(batch_size)
+
+    # find_all / count 的调用方可能需要读到自己刚写入的数据，始终读主节点
     def find_all(self, query: dict) -> List[Dict]:
         return list(self.collection.find(query))
 
     def count(self, query: dict):
         return self.collection.count_documents(query)
 
-    def import_from_json(self, filename: str) -> int:
+    def estimated_count(self, query: dict):
+        """无过滤条件时使用集合元数据估算总数，否则精确计数"""
+        if not query:
+            return self.read_collection.estimated_document_count()
+        return self.read_collection.count_documents(query)
+
+    def import_from_json(self, filename: str, batch_size: int = 1000, on_duplicate: str = "skip",
+                         progress_callback=None) -> Dict[str, int]:
         """
-        从JSON文件导入标注数据到数据库
-        
+        从JSON文件流式导入标注数据到数据库
+
+        支持 JSON 数组与 NDJSON，逐条解析并按 batch_size 分批无序写入，内存占用与文件大小无关。
+        只转换 _id 与已知的时间字段，其余字符串保持原样。
+
         Args:
-            filename: 输入JSON文件名
-            
+            filename: 输入文件名
+            batch_size: 每批写入的数据条数
+            on_duplicate: 重复数据的处理方式，"skip" 跳过或 "upsert" 覆盖
+            progress_callback: 每批写入后以当前统计调用
+
         Returns:
-            int: 导入的数据条数
+            Dict[str, int]: 读取、插入、覆盖、跳过与写入失败的数据条数，以及格式错误被跳过的条数 errors
         """
+        if on_duplicate not in ("skip", "upsert"):
+            raise ValueError(f"不支持的重复处理方式: {on_duplicate}")
+        stats = {"records": 0, "inserted": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": 0}
+        write_batch = self._insert_batch if on_duplicate == "skip" else self._upsert_batch
+
+        batch = []
+        for record in iter_json_records(filename):
+            stats["records"] += 1
+            try:
+                batch.append(_coerce_record(record))
+            except (ValueError, TypeError, InvalidId) as e:
+                # 单条格式错误的数据不影响整个导入
+                stats["errors"] += 1
+                logger.warning(f"第 {stats['records']} 条数据格式错误，已跳过: {e}")
+                continue
+            if len(batch) >= batch_size:
+                write_batch(batch, stats)
+                batch = []
+                logger.info(f"已导入 {stats['records']} 条: {stats}")
+                if progress_callback:
+                    progress_callback(dict(stats))
+        if batch:
+            write_batch(batch, stats)
+            if progress_callback:
+                progress_callback(dict(stats))
+
+        logger.info(f"导入完成: {stats}")
+        return stats
+
+    @staticmethod
+    def _counter_key(doc: Dict[str, Any]):
+        return doc.get("status"), doc.get("tag"), (doc.get("metadata") or {}).get("method_name")
+
+    def _insert_batch(self, batch: List[Dict[str, Any]], stats: Dict[str, int]):
+        """无序插入一批数据，重复键跳过"""
+        failed_indexes = set()
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 预处理数据：将_id字符串转换回ObjectId，将ISO时间字符串转换回datetime对象
-            processed_data = []
-            for item in data:
-                processed_item = item.copy()
-                
-                # 处理时间字段
-                for key, value in processed_item.items():
-                    if isinstance(value, str):
-                        try:
-                            # 尝试解析ISO格式的时间字符串
-                            processed_item[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                        except ValueError:
-                            # 如果不是时间字符串，则保持原样
-                            pass
-                
-                processed_data.append(processed_item)
-            
-            if processed_data:
-                result = self.collection.insert_many(processed_data)
-                count = len(result.inserted_ids)
-                logger.info(f"成功导入 {count} 条数据")
-                return count
+            self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed_indexes.add(error["index"])
+                if error.get("code") == 11000:
+                    stats["skipped"] += 1
+                else:
+                    stats["failed"] += 1
+                    logger.error(f"导入数据失败: {error.get('errmsg')}")
+        inserted = [doc for i, doc in enumerate(batch) if i not in failed_indexes]
+        stats["inserted"] += len(inserted)
+        self.counters.record_transitions((None, *self._counter_key(doc), 1) for doc in inserted)
+
+    def _upsert_batch(self, batch: List[Dict[str, Any]], stats: Dict[str, int]):
+        """按 _id（没有时按唯一键）覆盖写入一批数据，并按新旧状态修正计数器"""
+        filters = []
+        for doc in batch:
+            if "_id" in doc:
+                filters.append({"_id": doc["_id"]})
             else:
-                logger.info("导入文件为空")
-                return 0
-                
-        except Exception as e:
-            logger.error(f"导入数据时出错: {e}")
-            raise
\ No newline at end of file
+                filters.append({"lq_image_path": doc.get("lq_image_path"), "hq_image_path": doc.get("hq_image_path"),
+                                "metadata.method_name": (doc.get("metadata") or {}).get("method_name")})
+
+        # 一次查询取回将被覆盖的旧文档，用于修正计数器
+        existing_by_id, existing_by_key = {}, {}
+        for old in self.collection.find({"$or": filters}, {"status": 1, "tag": 1, "metadata.method_name": 1,
+                                                            "lq_image_path": 1, "hq_image_path": 1}):
+            existing_by_id[old["_id"]] = old
+            existing_by_key[(old.get("lq_image_path"), old.get("hq_image_path"),
+                             (old.get("metadata") or {}).get("method_name"))] = old
+
+        failed_indexes = set()
+        try:
+            self.collection.bulk_write(
+                [ReplaceOne(f, doc, upsert=True) for f, doc in zip(filters, batch)], ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed_indexes.add(error["index"])
+                stats["failed"] += 1
+                logger.error(f"导入数据失败: {error.get('errmsg')}")
+
+        transitions = []
+        for i, (f, doc) in enumerate(zip(filters, batch)):
+            if i in failed_indexes:
+                continue
+            if "_id" in f:
+                old = existing_by_id.get(f["_id"])
+            else:
+                old = existing_by_key.get((f["lq_image_path"], f["hq_image_path"], f["metadata.method_name"]))
+            if old:
+                stats["updated"] += 1
+                old_status, old_tag, old_method = self._counter_key(old)
+                transitions.append((old_status, None, old_tag, old_method, 1))
+            else:
+                stats["inserted"] += 1
+            transitions.append((None, *self._counter_key(doc), 1))
+        self.counters.record_transitions(transitions)
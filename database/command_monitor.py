@@ -0,0 +1,129 @@
+import threading
+import logging
+from typing import Dict, Any
+from pymongo import monitoring
+
+from utils.metrics import REGISTRY, current_action, add_action_hook, remove_action_hook
+
+logger = logging.getLogger(__name__)
+
+REGISTRY.describe("annotation_mongo_command_seconds", "MongoDB 命令耗时")
+REGISTRY.describe("annotation_mongo_command_errors_total", "MongoDB 命令失败次数")
+REGISTRY.describe("annotation_mongo_commands_per_action", "每次界面操作触发的 MongoDB 命令数",
+                  buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+
+UNATTRIBUTED = "unattributed"
+
+def _collection_of(command_name: str, command: Dict[str, Any]) -> str:
+    if command_name == "getMore":
+        return command.get("collection", "")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+def _docs_returned(reply: Dict[str, Any]) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if isinstance(reply.get("value"), dict):
+        return 1
+    return int(reply.get("n", 0) or 0)
+
+class CommandTracker(monitoring.CommandListener):
+    """
+    记录每条 MongoDB 命令（名称、集合、耗时、返回文档数），并归属到触发它的界面操作
+
+    操作由 utils.metrics.current_action 标记；命令事件在执行命令的线程中同步发布，
+    因此可以直接读取当前上下文。超过 slow_command_ms 的命令记录警告日志。
+    """
+    def __init__(self, slow_command_ms: float = 100):
+        self.slow_command_ms = slow_command_ms
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._actions = {}
+        add_action_hook(self._action_finished)
+
+    def _action_stats(self, name: str) -> Dict[str, Any]:
+        stats = self._actions.get(name)
+        if stats is None:
+            stats = self._actions[name] = {"calls": 0, "commands": 0, "max_commands": 0,
+                                           "mongo_seconds": 0.0, "by_command": {}}
+        return stats
+
+    def started(self, event):
+        key = (event.request_id, event.connection_id)
+        with self._lock:
+            self._pending[key] = (current_action.get(), event.command_name,
+                                  _collection_of(event.command_name, event.command))
+
+    def succeeded(self, event):
+        self._finish(event, _docs_returned(event.reply), failed=False)
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, docs: int, failed: bool):
+        with self._lock:
+            ctx, name, collection = self._pending.pop((event.request_id, event.connection_id),
+                                                      (None, event.command_name, ""))
+        seconds = event.duration_micros / 1e6
+        command_key = f"{name} {collection}".strip()
+
+        REGISTRY.observe("annotation_mongo_command_seconds", seconds, command=name, collection=collection)
+        if failed:
+            REGISTRY.inc("annotation_mongo_command_errors_total", command=name, collection=collection)
+
+        action_name = ctx.name if ctx is not None else UNATTRIBUTED
+        if seconds * 1000 >= self.slow_command_ms:
+            logger.warning(f"慢命令: {command_key} 耗时 {seconds * 1000:.1f} ms，返回 {docs} 条，来源 {action_name}")
+
+        if ctx is not None:
+            with self._lock:
+                ctx.commands += 1
+                ctx.mongo_seconds += seconds
+                ctx.by_command[command_key] = ctx.by_command.get(command_key, 0) + 1
+        else:
+            # 没有操作上下文的命令（例如启动时建索引）各自计为一次
+            with self._lock:
+                stats = self._action_stats(UNATTRIBUTED)
+                stats["calls"] += 1
+                stats["commands"] += 1
+                stats["max_commands"] = max(stats["max_commands"], 1)
+                stats["mongo_seconds"] += seconds
+                stats["by_command"][command_key] = stats["by_command"].get(command_key, 0) + 1
+
+    def close(self):
+        """停止接收操作结束事件"""
+        remove_action_hook(self._action_finished)
+
+    def _action_finished(self, ctx):
+        REGISTRY.observe("annotation_mongo_commands_per_action", ctx.commands, action=ctx.name)
+        with self._lock:
+            stats = self._action_stats(ctx.name)
+            stats["calls"] += 1
+            stats["commands"] += ctx.commands
+            stats["max_commands"] = max(stats["max_commands"], ctx.commands)
+            stats["mongo_seconds"] += ctx.mongo_seconds
+            for key, count in ctx.by_command.items():
+                stats["by_command"][key] = stats["by_command"].get(key, 0) + count
+
+    def report(self) -> Dict[str, Any]:
+        """
+        按操作汇总的“每次点击命令数”报告，按平均命令数从高到低排列
+
+        Returns:
+            Dict: 操作名 -> 调用次数、总命令数、平均/最大命令数、Mongo 总耗时及按命令的分布
+        """
+        with self._lock:
+            snapshot = {name: dict(stats, by_command=dict(stats["by_command"])) for name, stats in self._actions.items()}
+        rows = {}
+        for name, stats in snapshot.items():
+            calls = stats["calls"] or 1
+            rows[name] = {
+                "calls": stats["calls"],
+                "commands": stats["commands"],
+                "commands_per_call": stats["commands"] / calls,
+                "max_commands": stats["max_commands"],
+                "mongo_ms_per_call": stats["mongo_seconds"] * 1000 / calls,
+                "by_command": dict(sorted(stats["by_command"].items(), key=lambda item: -item[1])),
+            }
+        return dict(sorted(rows.items(), key=lambda item: -item[1]["commands_per_call"]))
@@ -1,29 +1,84 @@
-from pymongo import MongoClient
+import threading
+from pymongo import MongoClient, ReadPreference
 from pymongo.errors import ConnectionFailure
 import logging
 
 logger = logging.getLogger(__name__)
 
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+# 进程内共享的 MongoClient：相同的 uri、选项与监听器复用同一个连接池
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client_key(uri: str, options: dict, event_listeners: list):
+    normalized = tuple(sorted((k, ",".join(v) if isinstance(v, (list, tuple)) else v) for k, v in options.items()))
+    return uri, normalized, tuple(id(listener) for listener in event_listeners)
+
+def _acquire_client(uri: str, options: dict, event_listeners: list) -> MongoClient:
+    key = _client_key(uri, options, event_listeners)
+    with _clients_lock:
+        entry = _clients.get(key)
+        if entry is None:
+            # connect=False：不在构造时建立连接，首次执行命令时才连接
+            client = MongoClient(uri, connect=False, event_listeners=event_listeners, **options)
+            entry = _clients[key] = [client, 0]
+            logger.info("MongoDB客户端已创建，将在首次使用时连接")
+        entry[1] += 1
+        return entry[0]
+
+def _release_client(client: MongoClient):
+    with _clients_lock:
+        for key, entry in list(_clients.items()):
+            if entry[0] is client:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del _clients[key]
+                    client.close()
+                    logger.info("MongoDB连接已关闭")
+                return
+
 class MongoConnection:
-    def __init__(self, uri: str, db_name: str):
+    def __init__(self, uri: str, db_name: str, event_listeners=None, **client_options):
+        """
+        Args:
+            uri: MongoDB 连接地址
+            db_name: 数据库名
+            event_listeners: pymongo 事件监听器
+            client_options: 传给 MongoClient 的选项，如 maxPoolSize、minPoolSize、
+                            serverSelectionTimeoutMS、socketTimeoutMS、compressors
+        """
         self.uri = uri
         self.db_name = db_name
+        self.event_listeners = list(event_listeners or [])
+        self.client_options = {k: v for k, v in client_options.items() if v is not None}
         self.client = None
         self.db = None
         self._connect()
 
     def _connect(self):
+        self.client = _acquire_client(self.uri, self.client_options, self.event_listeners)
+        self.db = self.client[self.db_name]
+
+    def ping(self):
+        """显式检查连接是否可用"""
         try:
-            self.client = MongoClient(self.uri)
             self.client.admin.command('ping')
-            self.db = self.client[self.db_name]
-            logger.info("MongoDB连接成功")
         except ConnectionFailure as e:
             logger.error(f"MongoDB连接失败: {e}")
             raise
 
-    def get_collection(self, name: str):
-        return self.db[name]
+    def get_collection(self, name: str, read_preference: str = None):
+        collection = self.db[name]
+        if read_preference and read_preference != "primary":
+            collection = collection.with_options(read_preference=READ_PREFERENCES[read_preference])
+        return collection
 
     def create_indexes(self, collection_configs: dict):
         """collection_configs: {collection_name: [index_fields]}"""
@@ -44,5 +99,5 @@ class MongoConnection:
 
     def close(self):
         if self.client:
-            self.client.close()
-            logger.info("MongoDB连接已关闭")
\ No newline at end of file
+            _release_client(self.client)
+            self.client = None
@@ -0,0 +1,141 @@
+from datetime import datetime
+from typing import Dict, Any, Optional, Iterable, Tuple
+import logging
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ALL_STATUSES = ["pending", "annotating", "annotated", "duplicate"]
+COUNTERS_DOC_ID = "status_counters"
+
+def _field_key(name: Any) -> str:
+    """标签/方法名作为字段名时转义 '.' 和开头的 '$'"""
+    key = str(name).replace(".", "．")
+    if key.startswith("$"):
+        key = "＄" + key[1:]
+    return key
+
+class CounterRepository:
+    """
+    按状态维护的计数器文档（全局、按标签、按方法），每次状态变化时以 $inc 增量更新，
+    统计时只需一次 find_one
+
+    只有 recompute 会写入 initialized 标记，未初始化的文档（例如在已有数据的库上由增量建出的
+    只含差值的文档）不会被 get 返回，首次统计时会全量重算。
+    recompute 以增量方式修正：先读取计数快照，再按 (实际值 - 快照值) 做 $inc，
+    快照之后并发写入的增量因此会被保留而不是被覆盖；同时递增 recompute_epoch，
+    并以快照中的 epoch 作为条件，多个 recompute 并发时只有一个生效，避免重复修正。
+    """
+    def __init__(self, connection, collection_name: str):
+        self.collection = connection.get_collection(collection_name)
+
+    def _inc_paths(self, status: str, tag: Any, method: Any, delta: int, inc: Dict[str, int]):
+        for path in (f"global.{status}",
+                     f"tags.{_field_key(tag)}.{status}",
+                     f"methods.{_field_key(method)}.{status}"):
+            inc[path] = inc.get(path, 0) + delta
+
+    def record_transitions(self, transitions: Iterable[Tuple[Optional[str], Optional[str], Any, Any, int]]):
+        """
+        合并记录多个状态变化
+
+        Args:
+            transitions: (原状态, 新状态, 标签, 方法名, 数量) 序列，
+                         原状态为None表示新增，新状态为None表示删除
+        """
+        inc = {}
+        for from_status, to_status, tag, method, count in transitions:
+            if not count or from_status == to_status:
+                continue
+            if from_status:
+                self._inc_paths(from_status, tag, method, -count, inc)
+            if to_status:
+                self._inc_paths(to_status, tag, method, count, inc)
+        inc = {k: v for k, v in inc.items() if v}
+        if not inc:
+            return
+        try:
+            self.collection.update_one(
+                {"_id": COUNTERS_DOC_ID},
+                {"$inc": inc, "$set": {"updated_at": datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            # 计数失败不影响主流程，可通过 recompute 修正
+            logger.error(f"更新状态计数器时出错: {e}")
+
+    def record_transition(self, from_status: Optional[str], to_status: Optional[str], doc: Dict[str, Any], count: int = 1):
+        """根据文档中的 tag 与 metadata.method_name 记录一次状态变化"""
+        self.record_transitions([(from_status, to_status, doc.get("tag"),
+                                  (doc.get("metadata") or {}).get("method_name"), count)])
+
+    def get(self) -> Optional[Dict[str, Any]]:
+        """返回已初始化的计数器文档，不存在或未初始化时返回None"""
+        doc = self.collection.find_one({"_id": COUNTERS_DOC_ID})
+        return doc if doc and doc.get("initialized") else None
+
+    @staticmethod
+    def _flatten(doc: Dict[str, Any]) -> Dict[str, int]:
+        flat = {}
+        for section in ("global", "tags", "methods"):
+            values = doc.get(section) or {}
+            if section == "global":
+                flat.update({f"global.{k}": v for k, v in values.items()})
+            else:
+                for name, counts in values.items():
+                    flat.update({f"{section}.{name}.{k}": v for k, v in (counts or {}).items()})
+        return flat
+
+    def recompute(self, annotation_collection) -> Dict[str, Any]:
+        """
+        从标注集合全量重新计算计数器，并报告与现有计数的偏差
+
+        修正以 $inc 差值应用到计数器文档上，不会覆盖重算期间并发记录的增量。
+        若另一个 recompute 已先完成（epoch 已变化），本次不再重复修正，直接返回当前计数。
+
+        Returns:
+            Dict: 修正后的计数器文档（counters）以及 drift（路径 -> 实际值 - 计数值）
+        """
+        snapshot = self.collection.find_one({"_id": COUNTERS_DOC_ID}) or {}
+        epoch = snapshot.get("recompute_epoch", 0)
+
+        pipeline = [
+            {"$group": {
+                "_id": {"status": "$status", "tag": "$tag", "method": "$metadata.method_name"},
+                "count": {"$sum": 1}
+            }}
+        ]
+        actual = {}
+        for row in annotation_collection.aggregate(pipeline):
+            key = row["_id"]
+            self._inc_paths(key.get("status"), key.get("tag"), key.get("method"), row["count"], actual)
+
+        counted = self._flatten(snapshot)
+        drift = {}
+        for path in set(counted) | set(actual):
+            diff = actual.get(path, 0) - counted.get(path, 0)
+            if diff:
+                drift[path] = diff
+
+        # 文档尚不存在时 epoch 字段也不存在，以 $in [0, None] 同时匹配两种情况
+        epoch_filter = {"$in": [0, None]} if epoch == 0 else epoch
+        update = {"$set": {"initialized": True, "updated_at": datetime.now()},
+                  "$inc": {**drift, "recompute_epoch": 1}}
+        try:
+            counters = self.collection.find_one_and_update(
+                {"_id": COUNTERS_DOC_ID, "recompute_epoch": epoch_filter},
+                update,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # epoch 不匹配时 upsert 会尝试插入同一 _id：说明另一个 recompute 已经修正过
+            counters = None
+        if counters is None:
+            logger.info("状态计数器已被并发的重算修正，跳过本次修正")
+            return {"counters": self.collection.find_one({"_id": COUNTERS_DOC_ID}) or {}, "drift": {}}
+
+        if drift:
+            logger.warning(f"状态计数器存在偏差，已修正: {drift}")
+        return {"counters": counters, "drift": drift}
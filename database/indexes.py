@@ -0,0 +1,208 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+import logging
+from bson import ObjectId
+from pymongo import IndexModel, ASCENDING
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# 修改下方索引清单后递增版本号，启动时只有存储的版本与之不同的集合才会重新应用
+INDEX_SCHEMA_VERSION = 2
+INDEX_META_DOC_ID = "index_schema"
+
+# 被复合索引覆盖或不再有查询使用的旧索引，应用新版本时删除以减少写入开销：
+# status 是 (status, _id) 的前缀；assigned_user / assigned_at 的查询总是带 _id 或 status
+OBSOLETE_ANNOTATION_INDEXES = ["status_1", "assigned_user_1", "assigned_at_1"]
+
+def build_index_manifest(annotation_collection: str, user_collection: str,
+                         history_collection: str) -> Dict[str, List[IndexModel]]:
+    """
+    按实际查询形态定义的索引清单
+
+    Args:
+        annotation_collection: 标注集合名
+        user_collection: 用户集合名
+        history_collection: 用户历史集合名
+
+    Returns:
+        Dict[str, List[IndexModel]]: 集合名 -> 索引列表
+    """
+    return {
+        annotation_collection: [
+            # 领取任务、按状态分页/键集翻页、预生成：status 等值 + _id 排序
+            IndexModel([("status", ASCENDING), ("_id", ASCENDING)]),
+            # 非管理员的审查列表与 distinct 更新人：last_updated_by + status 等值 + _id 排序
+            IndexModel([("last_updated_by", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)]),
+            # 过期租约清理
+            IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)]),
+            # 导入时的 upsert 唯一键
+            IndexModel([("lq_image_path", ASCENDING), ("hq_image_path", ASCENDING),
+                        ("metadata.method_name", ASCENDING)], unique=True),
+            # 重复组同步
+            IndexModel([("metadata.dup_group", ASCENDING)]),
+        ],
+        user_collection: [
+            IndexModel([("username", ASCENDING)]),
+            IndexModel([("user_id", ASCENDING)]),
+        ],
+        history_collection: [
+            IndexModel([("user_id", ASCENDING)]),
+            IndexModel([("task_ids", ASCENDING)]),
+        ],
+    }
+
+def find_duplicate_keys(collection, keys: List[str], sample: int = 5) -> Dict[str, Any]:
+    """
+    统计在 keys 上取值重复的文档，用于创建唯一索引前的检查
+
+    Returns:
+        Dict: groups（重复的键组合数量）、documents（涉及的文档数量）与 examples（部分示例）
+    """
+    pipeline = [
+        {"$group": {"_id": {k.replace(".", "_"): f"${k}" for k in keys}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    groups, documents, examples = 0, 0, []
+    for row in collection.aggregate(pipeline, allowDiskUse=True):
+        groups += 1
+        documents += row["count"]
+        if len(examples) < sample:
+            examples.append({**row["_id"], "count": row["count"]})
+    return {"groups": groups, "documents": documents, "examples": examples}
+
+def ensure_indexes(connection, manifest: Dict[str, List[IndexModel]], meta_collection: str,
+                   obsolete: Optional[Dict[str, List[str]]] = None,
+                   version: int = INDEX_SCHEMA_VERSION) -> List[str]:
+    """
+    按版本幂等地应用索引清单
+
+    每个集合已应用的版本记录在 meta_collection 的 index_schema 文档中，版本一致时跳过，
+    因此正常启动只需一次 find_one。createIndexes 本身是幂等的，多个进程同时应用也不会冲突。
+    创建唯一索引前先检查已有数据中的重复键：存在重复时记录错误并跳过该索引，
+    该集合的版本不更新，清理重复数据后下次启动会重新应用。
+
+    Args:
+        connection: MongoConnection
+        manifest: 集合名 -> 索引列表
+        meta_collection: 记录索引版本的集合名
+        obsolete: 集合名 -> 需要删除的旧索引名
+        version: 清单版本
+
+    Returns:
+        List[str]: 本次应用了索引的集合名
+    """
+    meta = connection.get_collection(meta_collection)
+    applied = (meta.find_one({"_id": INDEX_META_DOC_ID}) or {}).get("collections", {})
+    obsolete = obsolete or {}
+
+    updated = []
+    for coll_name, indexes in manifest.items():
+        if applied.get(coll_name) == version:
+            continue
+        coll = connection.get_collection(coll_name)
+        creatable = []
+        for index in indexes:
+            document = index.document
+            if document.get("unique"):
+                duplicates = find_duplicate_keys(coll, list(document["key"].keys()))
+                if duplicates["groups"]:
+                    logger.error(
+                        f"集合 {coll_name} 中有 {duplicates['documents']} 条数据在 {list(document['key'].keys())} 上重复"
+                        f"（{duplicates['groups']} 组），暂不创建唯一索引 {document['name']}，请先清理重复数据。"
+                        f"示例: {duplicates['examples']}"
+                    )
+                    continue
+            creatable.append(index)
+        names = coll.create_indexes(creatable) if creatable else []
+        for name in obsolete.get(coll_name, []):
+            try:
+                coll.drop_index(name)
+                logger.info(f"已删除集合 {coll_name} 的旧索引 {name}")
+            except OperationFailure:
+                # 索引不存在
+                pass
+        updated.append(coll_name)
+        if len(creatable) < len(indexes):
+            continue
+        meta.update_one(
+            {"_id": INDEX_META_DOC_ID},
+            {"$set": {f"collections.{coll_name}": version, "updated_at": datetime.now()}},
+            upsert=True
+        )
+        logger.info(f"集合 {coll_name} 的索引已更新到版本 {version}: {', '.join(names)}")
+    return updated
+
+def hot_queries(lock_timeout: int = 300, user_id: str = "explain_user") -> List[Dict[str, Any]]:
+    """
+    标注集合上的热点查询形态，用于 explain 检查
+
+    Returns:
+        List[Dict]: 每项包含 name、filter 以及可选的 sort / limit
+    """
+    now = datetime.now()
+    anchor = ObjectId()
+    return [
+        {"name": "get_next_pending", "filter": {"status": "pending"}, "sort": [("_id", 1)], "limit": 1},
+        {"name": "find_with_pagination", "filter": {"status": "annotated"}, "sort": [("_id", 1)], "limit": 20},
+        {"name": "find_page_by_key",
+         "filter": {"$and": [{"status": "annotated"}, {"_id": {"$gt": anchor}}]}, "sort": [("_id", 1)], "limit": 20},
+        {"name": "review_list_user",
+         "filter": {"status": "annotated", "last_updated_by": user_id}, "sort": [("_id", 1)], "limit": 20},
+        {"name": "review_list_user_all", "filter": {"last_updated_by": user_id}, "sort": [("_id", 1)], "limit": 20},
+        {"name": "find_pending_without_text",
+         "filter": {"status": "pending", "generated_text": {"$in": ["", None]}}, "sort": [("_id", 1)], "limit": 100},
+        {"name": "cleanup_expired_locks",
+         "filter": {"status": "annotating", "$or": [
+             {"lease_expires_at": {"$lt": now}},
+             {"lease_expires_at": {"$exists": False}, "assigned_at": {"$lt": now - timedelta(seconds=lock_timeout)}}
+         ]}, "limit": 500},
+        {"name": "upsert_key",
+         "filter": {"lq_image_path": "", "hq_image_path": "", "metadata.method_name": ""}, "limit": 1},
+        {"name": "dup_group", "filter": {"metadata.dup_group": "", "_id": {"$ne": anchor}}},
+    ]
+
+def _plan_stages(plan: Dict[str, Any], stages: List[str], index_names: List[str]):
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        stages.append(plan["stage"])
+    if plan.get("indexName"):
+        index_names.append(plan["indexName"])
+    for key in ("inputStage", "queryPlan"):
+        _plan_stages(plan.get(key), stages, index_names)
+    for child in plan.get("inputStages", []):
+        _plan_stages(child, stages, index_names)
+
+def explain_query(collection, query: Dict[str, Any], sort=None, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    对一个查询执行 explain，并汇总其执行计划
+
+    Args:
+        collection: pymongo 集合
+        query: 查询条件
+        sort: 排序，如 [("_id", 1)]
+        limit: 数量上限
+
+    Returns:
+        Dict: stages（获胜计划的各阶段）、indexes（使用的索引）、collscan（是否全表扫描）、
+              keys_examined / docs_examined / returned
+    """
+    cursor = collection.find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    explained = cursor.explain()
+
+    stages, index_names = [], []
+    _plan_stages(explained.get("queryPlanner", {}).get("winningPlan", {}), stages, index_names)
+    execution = explained.get("executionStats", {})
+    return {
+        "stages": stages,
+        "indexes": index_names,
+        "collscan": "COLLSCAN" in stages,
+        "keys_examined": execution.get("totalKeysExamined"),
+        "docs_examined": execution.get("totalDocsExamined"),
+        "returned": execution.get("nReturned"),
+    }
@@ -0,0 +1,94 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any
+import logging
+
+from utils.metrics import action_scope
+
+logger = logging.getLogger(__name__)
+
+class LeaseReaper:
+    """
+    后台租约回收线程
+
+    周期性地将租约过期的 annotating 任务重置为 pending，并分批修正用户历史，
+    使过期处理不再发生在用户请求路径上。
+    """
+    def __init__(self, annotations, user_history, interval: float = 30, batch_size: int = 500):
+        self.annotations = annotations
+        self.user_history = user_history
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "batches": 0,
+            "expired_tasks": 0,
+            "cleaned_histories": 0,
+            "errors": 0,
+            "last_run_at": None,
+            "last_run_seconds": 0.0,
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="lease-reaper", daemon=True)
+        self._thread.start()
+        logger.info(f"租约回收线程已启动，间隔 {self.interval}s，批次大小 {self.batch_size}")
+
+    def stop(self, timeout: float = 5):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info("租约回收线程已停止")
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._stop_event.wait(self.interval)
+
+    def run_once(self) -> int:
+        """
+        执行一轮回收，直到没有过期任务或收到停止信号
+
+        Returns:
+            int: 本轮重置的任务数量
+        """
+        started = time.perf_counter()
+        reaped = 0
+        batches = 0
+        cleaned = 0
+        try:
+            with action_scope("LeaseReaper.run_once"):
+                while not self._stop_event.is_set():
+                    num_expired, expired_doc_ids = self.annotations.cleanup_expired_locks(self.batch_size)
+                    if num_expired == 0:
+                        break
+                    batches += 1
+                    reaped += num_expired
+                    cleaned += self.user_history.cleanup_user_histories_for_expired_tasks(expired_doc_ids)
+                    if num_expired < self.batch_size:
+                        break
+        except Exception as e:
+            logger.error(f"回收过期租约时出错: {e}")
+            with self._stats_lock:
+                self._stats["errors"] += 1
+
+        with self._stats_lock:
+            self._stats["runs"] += 1
+            self._stats["batches"] += batches
+            self._stats["expired_tasks"] += reaped
+            self._stats["cleaned_histories"] += cleaned
+            self._stats["last_run_at"] = datetime.now()
+            self._stats["last_run_seconds"] = time.perf_counter() - started
+        return reaped
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return dict(self._stats)
@@ -1,78 +1,163 @@
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import logging
+from pymongo import ReturnDocument
 
 logger = logging.getLogger(__name__)
 
+# 历史记录只保存任务ID数组 task_ids，以及当前位置 current_index
+# 下面的查找投影使用了聚合表达式（$arrayElemAt、$size 等），需要 MongoDB 4.4 及以上版本
+_TASK_IDS = {"$ifNull": ["$task_ids", []]}
+_CURRENT_TASK_ID = {
+    "$cond": [
+        {"$and": [{"$gte": ["$current_index", 0]}, {"$lt": ["$current_index", {"$size": _TASK_IDS}]}]},
+        {"$arrayElemAt": [_TASK_IDS, "$current_index"]},
+        None
+    ]
+}
+_POSITION_PROJECTION = {
+    "_id": 0,
+    "current_index": 1,
+    "length": {"$size": _TASK_IDS},
+    "task_id": _CURRENT_TASK_ID,
+}
+
+def _removal_pipeline(doc_ids: List[str], now: datetime) -> List[Dict[str, Any]]:
+    """
+    从 task_ids 中移除 doc_ids 的更新管道，并在服务端调整 current_index：
+    当前位置及之前每移除一个任务，current_index 前移一位（最小为 -1）
+    """
+    removed_before = {
+        "$size": {"$filter": {
+            "input": {"$cond": [
+                {"$gte": ["$current_index", 0]},
+                {"$slice": [_TASK_IDS, {"$add": ["$current_index", 1]}]},
+                []
+            ]},
+            "cond": {"$in": ["$$this", doc_ids]}
+        }}
+    }
+    return [
+        {"$set": {
+            "current_index": {"$max": [-1, {"$subtract": [{"$ifNull": ["$current_index", -1]}, removed_before]}]},
+            "task_ids": {"$filter": {"input": _TASK_IDS, "cond": {"$not": [{"$in": ["$$this", doc_ids]}]}}},
+            "updated_at": now
+        }}
+    ]
+
 class UserHistoryRepository:
     def __init__(self, connection, collection_name: str):
         self.collection = connection.get_collection(collection_name)
 
+    def migrate_legacy_histories(self) -> int:
+        """将旧版内嵌完整任务文档的 tasks 数组转换为只保存ID的 task_ids"""
+        try:
+            result = self.collection.update_many(
+                {"tasks": {"$exists": True}},
+                [
+                    {"$set": {"task_ids": {"$map": {"input": "$tasks", "in": {"$toString": "$$this._id"}}}}},
+                    {"$unset": "tasks"}
+                ]
+            )
+            if result.modified_count:
+                logger.info(f"迁移了 {result.modified_count} 个用户的历史记录")
+            return result.modified_count
+        except Exception as e:
+            logger.error(f"迁移用户历史记录时出错: {e}")
+            return 0
+
     def add_task(self, user_id: str, task: Dict[str, Any]) -> bool:
         """
-        将任务添加到用户历史记录
-        
+        将任务ID追加到用户历史记录末尾，并把当前位置指向它
+
         Args:
             user_id: 用户ID
             task: 任务数据
-            
+
         Returns:
             bool: 操作是否成功
         """
         try:
-            # 获取用户当前历史记录
-            history_doc = self.collection.find_one({"user_id": user_id})
-            
-            if history_doc:
-                # 如果存在历史记录，更新历史记录
-                history_doc['tasks'].append(task)
-                history_doc['current_index'] = len(history_doc['tasks']) - 1
-                history_doc['updated_at'] = datetime.now()
-                
-                result = self.collection.replace_one(
-                    {"user_id": user_id},
-                    history_doc
-                )
-            else:
-                # 如果不存在历史记录，创建新的
-                new_history_doc = {
-                    "user_id": user_id,
-                    "tasks": [task],
-                    "current_index": 0,
-                    "created_at": datetime.now(),
-                    "updated_at": datetime.now()
-                }
-                
-                self.collection.insert_one(new_history_doc)
-            
+            now = datetime.now()
+            self.collection.update_one(
+                {"user_id": user_id},
+                [
+                    {"$set": {
+                        "task_ids": {"$concatArrays": [_TASK_IDS, [str(task['_id'])]]},
+                        "created_at": {"$ifNull": ["$created_at", now]},
+                        "updated_at": now
+                    }},
+                    {"$set": {"current_index": {"$subtract": [{"$size": "$task_ids"}, 1]}}}
+                ],
+                upsert=True
+            )
+
             logger.info(f"用户 {user_id} 的任务历史已更新")
             return True
-            
+
         except Exception as e:
             logger.error(f"添加任务到用户历史时出错: {e}")
             return False
 
-    def get_history(self, user_id: str) -> List[Dict[str, Any]]:
+    def get_position(self, user_id: str) -> Dict[str, Any]:
         """
-        获取用户任务历史记录
-        
+        获取用户当前位置，不读取整个历史数组
+
         Args:
             user_id: 用户ID
-            
+
         Returns:
-            List[Dict]: 任务历史列表
+            Dict: current_index、历史长度 length 及当前任务ID task_id
         """
         try:
-            history_doc = self.collection.find_one({"user_id": user_id})
-            
+            history_doc = self.collection.find_one({"user_id": user_id}, _POSITION_PROJECTION)
             if history_doc:
-                return history_doc.get('tasks', [])
-            else:
-                return []
-                
+                return history_doc
         except Exception as e:
-            logger.error(f"获取用户任务历史时出错: {e}")
-            return []
+            logger.error(f"获取用户历史位置时出错: {e}")
+        return {"current_index": -1, "length": 0, "task_id": None}
+
+    def peek_next_task_id(self, user_id: str) -> Optional[str]:
+        """获取当前位置的下一条任务ID（不移动位置），已在末尾时返回None"""
+        try:
+            history_doc = self.collection.find_one(
+                {"user_id": user_id},
+                {"_id": 0, "task_id": {"$arrayElemAt": [_TASK_IDS, {"$add": [{"$ifNull": ["$current_index", -1]}, 1]}]}}
+            )
+            return history_doc.get("task_id") if history_doc else None
+        except Exception as e:
+            logger.error(f"获取下一条历史任务时出错: {e}")
+            return None
+
+    def move_current_index(self, user_id: str, delta: int) -> Optional[Dict[str, Any]]:
+        """
+        在服务端移动当前位置并返回新位置上的任务ID
+
+        前进时仅在后面还有历史任务时才移动；后退时最小退到 -1。
+
+        Args:
+            user_id: 用户ID
+            delta: 1 表示下一条，-1 表示上一条
+
+        Returns:
+            Optional[Dict]: current_index、length、task_id；前进但已在末尾或无历史时返回None
+        """
+        try:
+            query = {"user_id": user_id}
+            if delta > 0:
+                query["$expr"] = {"$lt": [{"$add": ["$current_index", delta]}, {"$size": _TASK_IDS}]}
+            return self.collection.find_one_and_update(
+                query,
+                [{"$set": {
+                    "current_index": {"$max": [-1, {"$add": ["$current_index", delta]}]},
+                    "updated_at": datetime.now()
+                }}],
+                projection=_POSITION_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            logger.error(f"移动用户历史位置时出错: {e}")
+            return None
 
     def get_current_index(self, user_id: str) -> int:
         """
@@ -85,7 +170,7 @@ class UserHistoryRepository:
             int: 当前索引，如果不存在则返回-1
         """
         try:
-            history_doc = self.collection.find_one({"user_id": user_id})
+            history_doc = self.collection.find_one({"user_id": user_id}, {"current_index": 1})
             
             if history_doc:
                 return history_doc.get('current_index', -1)
@@ -95,85 +180,35 @@ class UserHistoryRepository:
             logger.error(f"获取用户当前历史索引时出错: {e}")
             return -1
 
-    def update_current_index(self, user_id: str, index: int) -> bool:
-        """
-        更新用户当前历史记录索引
-        
-        Args:
-            user_id: 用户ID
-            index: 新索引
-            
-        Returns:
-            bool: 操作是否成功
-        """
+    def remove_task(self, user_id: str, doc_id: str) -> bool:
+        """从用户历史中移除任务，并相应调整当前位置"""
         try:
             result = self.collection.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {
-                        "current_index": index,
-                        "updated_at": datetime.now()
-                    }
-                }
+                {"user_id": user_id, "task_ids": doc_id},
+                _removal_pipeline([doc_id], datetime.now())
             )
-            
             return result.modified_count > 0
-            
-        except Exception as e:
-            logger.error(f"更新用户当前历史索引时出错: {e}")
-            return False
-    
-    def update_history(self, user_id, history):
-        try:
-            result = self.collection.update_one(
-                {"user_id": user_id},
-                {"$set": {"tasks": history}},
-                upsert=True
-            )
-            return result.modified_count > 0 or result.upserted_id is not None
         except Exception as e:
-            logger.error(f"更新用户历史失败: {e}")
+            logger.error(f"从用户历史中移除任务失败: {e}")
             return False
-    
-    def cleanup_user_histories_for_expired_tasks(self, expired_doc_ids: List[str]):
-        """从用户历史中移除已过期的任务"""
-        try:
-            for doc_id in expired_doc_ids:
-                # 查找所有 history 中包含该 task _id 的用户
-                users_cursor = self.collection.find({
-                    "tasks._id": doc_id
-                })
-
-                for user_doc in users_cursor:
-                    user_id = user_doc["user_id"]
-                    tasks = user_doc.get("tasks", [])
-                    current_index = user_doc.get("current_index", -1)
-
-                    # 过滤掉过期任务
-                    new_tasks = [t for t in tasks if str(t.get("_id")) != doc_id]
-
-                    # 调整 current_index
-                    new_index = current_index
-                    if 0 <= current_index < len(tasks):
-                        if str(tasks[current_index].get("_id")) == doc_id:
-                            # 当前任务被删除：回退到前一个，或设为 -1
-                            if new_tasks:
-                                new_index = min(current_index - 1, len(new_tasks) - 1)
-                            else:
-                                new_index = -1
-
-                    # 更新用户历史
-                    self.collection.update_one(
-                        {"user_id": user_id},
-                        {
-                            "$set": {
-                                "tasks": new_tasks,
-                                "current_index": new_index,
-                                "updated_at": datetime.now()
-                            }
-                        }
-                    )
-                    logger.debug(f"用户 {user_id} 的历史中移除了过期任务 {doc_id}")
 
-        except Exception as e:
-            logger.error(f"清理用户历史中的过期任务时出错: {e}")
\ No newline at end of file
+    def cleanup_user_histories_for_expired_tasks(self, expired_doc_ids: List[str]) -> int:
+        """
+        从所有用户历史中批量移除已过期的任务
+
+        一次 update_many 完成移除与 current_index 调整，命令数量与过期任务数量无关。
+
+        Returns:
+            int: 被修改的用户历史数量
+
+        Raises:
+            Exception: 数据库错误直接抛出，由租约回收线程计入错误统计
+        """
+        if not expired_doc_ids:
+            return 0
+        result = self.collection.update_many(
+            {"task_ids": {"$in": expired_doc_ids}},
+            _removal_pipeline(expired_doc_ids, datetime.now())
+        )
+        logger.debug(f"{result.modified_count} 个用户的历史中移除了 {len(expired_doc_ids)} 个过期任务")
+        return result.modified_count
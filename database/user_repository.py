@@ -2,10 +2,22 @@ import secrets
 import datetime
 
 from model import User
+from utils.cache_utils import TTLCache
+from utils.metrics import REGISTRY, cache_samples
 
 class UserRepository:
-    def __init__(self, connection, collection_name: str):
+    def __init__(self, connection, collection_name: str, cache_size: int = 1024, cache_ttl: float = 300):
         self.collection = connection.get_collection(collection_name)
+        self._cache = TTLCache(cache_size, cache_ttl)
+        REGISTRY.register_collector("user_cache", lambda: cache_samples("user", self._cache.stats()))
+    
+    def _to_user(self, user_doc):
+        return User(
+            user_id=user_doc['user_id'],
+            username=user_doc['username'],
+            created_at=user_doc['created_at'],
+            last_login=user_doc.get('last_login')
+        )
     
     def _generate_user_id(self) -> str:
         """生成唯一的用户ID"""
@@ -36,6 +48,7 @@ class UserRepository:
             result = self.collection.insert_one(user_doc)
             
             if result.inserted_id:
+                self._cache.invalidate(user_id)
                 return User(
                     user_id=user_id,
                     username=username,
@@ -64,6 +77,7 @@ class UserRepository:
                 {"_id": user_doc['_id']},
                 {"$set": {"last_login": datetime.datetime.now()}}
             )
+            self._cache.invalidate(user_doc['user_id'])
             
             return User(
                 user_id=user_doc['user_id'],
@@ -77,20 +91,52 @@ class UserRepository:
             return None
     
     def get_user_by_id(self, user_id):
-        """根据ID获取用户"""
+        """根据ID获取用户（优先读取缓存）"""
+        user = self._cache.get(user_id)
+        if user is not None:
+            return user
         try:
             user_doc = self.collection.find_one({"user_id": user_id})
             
             if user_doc:
-                return User(
-                    user_id=user_doc['user_id'],
-                    username=user_doc['username'],
-                    created_at=user_doc['created_at'],
-                    last_login=user_doc.get('last_login')
-                )
+                user = self._to_user(user_doc)
+                self._cache.set(user_id, user)
+                return user
             else:
                 return None
                 
         except Exception as e:
             print(f"获取用户时出错: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def get_users_by_ids(self, user_ids):
+        """
+        批量获取用户，未命中缓存的ID通过一次 $in 查询获取
+
+        Args:
+            user_ids: 用户ID可迭代对象
+
+        Returns:
+            Dict[str, User]: user_id -> User，不存在的ID不会出现在结果中
+        """
+        users = {}
+        missing = []
+        for user_id in set(user_ids):
+            if not user_id:
+                continue
+            user = self._cache.get(user_id)
+            if user is not None:
+                users[user_id] = user
+            else:
+                missing.append(user_id)
+
+        if not missing:
+            return users
+        try:
+            for user_doc in self.collection.find({"user_id": {"$in": missing}}):
+                user = self._to_user(user_doc)
+                self._cache.set(user.user_id, user)
+                users[user.user_id] = user
+        except Exception as e:
+            print(f"批量获取用户时出错: {e}")
+        return users
@@ -1,11 +1,13 @@
+import asyncio
 import gradio as gr
 from core.annotation_interface import AnnotationBusinessLogic
 
 class AnnotationUI:
-    def __init__(self, db, role):
-        self.controller = AnnotationBusinessLogic(db)
+    def __init__(self, db, role, prefetch_workers=4):
+        self.controller = AnnotationBusinessLogic(db, prefetch_workers=prefetch_workers)
         self.annotation_options = self.controller.annotation_options
         self.visible = True
+        self._session_users = {}  # gradio session_hash -> user_id，页面关闭时释放预领取
 
     def create_interface(self, user_state: gr.State) -> gr.Blocks:
         with gr.Blocks(title="图像质量标注系统", theme=gr.themes.Soft()) as demo:
@@ -19,6 +21,7 @@ class AnnotationUI:
                             lq_image = gr.Image(label="低质量图像", interactive=False, height=400)
                         with gr.Column():
                             hq_image = gr.Image(label="修复图像", interactive=False, height=400)
+                    full_res = gr.Checkbox(label="加载原图", value=False)
                     status = gr.Textbox(label="任务状态", interactive=False)
                     with gr.Row():
                         prev_btn = gr.Button("⬅️ 上一张", variant="secondary")
@@ -64,8 +67,8 @@ class AnnotationUI:
             def update_user_info(user_id):
                 return self.controller.get_user_display_info(user_id)
 
-            def load_previous(user_id):
-                result = self.controller.load_previous_task(user_id)
+            def load_previous(user_id, full_resolution):
+                result = self.controller.load_previous_task(user_id, full_resolution)
                 task_id = result.get('status', '').split(' ')[1] if '当前任务:' in result['status'] else None
                 return (
                     update_user_info(user_id),
@@ -76,8 +79,14 @@ class AnnotationUI:
                     task_id
                 )
 
-            def load_next(user_id):
-                result = self.controller.load_next_task(user_id)
+            def load_next(user_id, full_resolution, request: gr.Request):
+                if user_id and request:
+                    previous = self._session_users.get(request.session_hash)
+                    if previous and previous != user_id:
+                        # 同一页面切换了登录用户
+                        self.controller.release_prefetched(previous)
+                    self._session_users[request.session_hash] = user_id
+                result = self.controller.load_next_task(user_id, full_resolution)
                 new_task_id = result.get('status', '').split(' ')[1] if '当前任务:' in result['status'] else None
                 return (
                     update_user_info(user_id),
@@ -88,14 +97,17 @@ class AnnotationUI:
                     new_task_id
                 )
             
+            def load_images(task_id, full_resolution):
+                return self.controller.load_task_images(task_id, full_resolution)
+
             def cancel_task(user_id, task_id):
                 if not task_id:
                     return update_user_info(user_id), "无任务可取消", None
                 msg = self.controller.cancel_current_task(user_id, task_id)
                 return update_user_info(user_id), msg, None
             
-            def generate_text(task_id, *args):
-                tag = self.controller.get_tag(task_id)
+            async def generate_text(task_id, *args):
+                tag = await asyncio.to_thread(self.controller.get_tag, task_id)
                 num_angles = len(self.annotation_options)
     
                 selected_options = {}
@@ -105,7 +117,7 @@ class AnnotationUI:
                 lq_image_input = args[num_angles]
                 hq_image_input = args[num_angles + 1]
                 
-                result = self.controller.generate_text_with_llm(
+                result = await self.controller.generate_text_with_llm(
                     selected_options, lq_image_input, hq_image_input, tag
                 )
                 return result
@@ -129,6 +141,7 @@ class AnnotationUI:
                 - 待标注: {stats.get('pending', 0)}
                 - 标注中: {stats.get('annotating', 0)}
                 - 已标注: {stats.get('annotated', 0)}
+                - 重复（随代表同步）: {stats.get('duplicate', 0)}
                 - 总计: {stats.get('total', 0)}
                 """
                 return stats_text
@@ -136,22 +149,44 @@ class AnnotationUI:
             def clear_text():
                 return ""
 
+            def release_session(request: gr.Request):
+                user_id = self._session_users.pop(request.session_hash, None) if request else None
+                if user_id and user_id not in self._session_users.values():
+                    self.controller.release_prefetched(user_id)
+
             demo.load(update_user_info, inputs=user_state, outputs=user_info)
+            # 关闭页面时释放为该用户预领取的任务
+            demo.unload(release_session)
+
+            # 切换任务时取消进行中的生成请求
+            generate_event = generate_btn.click(
+                generate_text,
+                inputs=[current_task_id_state] + [selected_options[a] for a in self.annotation_options.keys()] + [lq_image, hq_image],
+                outputs=[user_text]
+            )
 
             next_btn.click(
                 load_next,
-                inputs=[user_state],
+                inputs=[user_state, full_res],
                 outputs=[user_info, lq_image, hq_image, status] + 
                     [selected_options[angle] for angle in self.annotation_options.keys()] + 
-                    [user_text, save_status, current_task_id_state]
+                    [user_text, save_status, current_task_id_state],
+                cancels=[generate_event]
             )
             
             prev_btn.click(
                 load_previous,
-                inputs=user_state,
+                inputs=[user_state, full_res],
                 outputs=[user_info, lq_image, hq_image, status] + 
                     [selected_options[angle] for angle in self.annotation_options.keys()] + 
-                    [user_text, save_status, current_task_id_state]
+                    [user_text, save_status, current_task_id_state],
+                cancels=[generate_event]
+            )
+
+            full_res.change(
+                load_images,
+                inputs=[current_task_id_state, full_res],
+                outputs=[lq_image, hq_image]
             )
 
             cancel_btn.click(
@@ -160,12 +195,6 @@ class AnnotationUI:
                 outputs=[user_info, status, current_task_id_state]
             )
 
-            generate_btn.click(
-                generate_text,
-                inputs=[current_task_id_state] + [selected_options[a] for a in self.annotation_options.keys()] + [lq_image, hq_image],
-                outputs=[user_text]
-            )
-
             clear_text_btn.click(clear_text, outputs=[user_text])
 
             save_btn.click(
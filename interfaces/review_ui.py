@@ -1,3 +1,4 @@
+import asyncio
 import gradio as gr
 from core.review_interface import ReviewBusinessLogic
 
@@ -11,12 +12,13 @@ class ReviewUI:
     def create_interface(self, user_state: gr.State) -> gr.Blocks:
         with gr.Blocks(title="标注结果展示界面", theme=gr.themes.Soft()) as review_demo:
             task_id_input = gr.State()
+            list_cursor = gr.State(None)
             with gr.Row():
                 # 左侧：任务列表和筛选
                 with gr.Column(scale=1):
                     with gr.Row():
                         filter_status = gr.Dropdown(
-                            choices=["annotated", "pending", "annotating", "all"],
+                            choices=["annotated", "pending", "annotating", "duplicate", "all"],
                             value="annotated",
                             label="筛选状态"
                         )
@@ -51,7 +53,8 @@ class ReviewUI:
                         export_status = gr.Textbox(label="导出状态", interactive=False)
 
                     with gr.Tab("导入", visible=self.visible):
-                        import_file = gr.File(label="选择JSON文件", file_types=[".json"])
+                        import_file = gr.File(label="选择JSON文件", file_types=[".json", ".jsonl", ".ndjson"])
+                        import_overwrite = gr.Checkbox(label="覆盖已存在的数据", value=False)
                         import_btn = gr.Button("📥 导入", variant="primary")
                         import_status = gr.Textbox(label="导入状态", interactive=False)
 
@@ -66,6 +69,7 @@ class ReviewUI:
                             lq_image = gr.Image(label="低质量图像", interactive=False, height=400)
                         with gr.Column():
                             hq_image = gr.Image(label="修复图像", interactive=False, height=400)
+                    full_res = gr.Checkbox(label="加载原图", value=False)
 
                     selected_options = {}
                     angles = list(self.annotation_options.keys())
@@ -95,20 +99,20 @@ class ReviewUI:
                     update_status = gr.Textbox(label="更新状态", interactive=False)
 
             # Event handlers
-            def load_task_list(page=1, page_size=10, filter_status="annotated", user_state=None):
-                return self.controller.load_task_list(int(page), int(page_size), filter_status, role=self.role, user_id=user_state)
+            def load_task_list(page=1, page_size=10, filter_status="annotated", user_state=None, cursor=None):
+                return self.controller.load_task_list(int(page), int(page_size), filter_status, role=self.role, user_id=user_state, cursor=cursor)
 
             def jump_to_page(target_page, page_size, filter_status, user_state=None):
                 target = int(target_page) if target_page else 1
                 return load_task_list(target, page_size, filter_status, user_state=user_state)
             
-            def load_selected_task(evt: gr.SelectData):
+            def load_selected_task(full_resolution, evt: gr.SelectData):
                 row = evt.row_value
                 if not row or len(row) < 1:
                     default_opts = [self.annotation_options[a]["value"] for a in self.annotation_options.keys()]
                     return [None, "无效任务"] + [None, None] + default_opts + ["", ""]
                 task_id = row[0]
-                result = self.controller.load_task_for_review(task_id)
+                result = self.controller.load_task_for_review(task_id, full_resolution)
                 lq_img, hq_img, status, opts, txt, err = result
                 opt_vals = [
                     opts.get(a, self.annotation_options[a]["value"]) 
@@ -121,20 +125,21 @@ class ReviewUI:
                 user_txt = args[len(self.annotation_options)]
                 return self.controller.update_task_in_db(task_id, selected, user_txt)
 
-            def generate_text(*args):
+            async def generate_text(task_id, *args):
+                tag = await asyncio.to_thread(self.controller.get_tag, task_id)
                 num = len(self.annotation_options)
                 selected = {a: args[i] for i, a in enumerate(self.annotation_options.keys())}
                 lq_img = args[num]
                 hq_img = args[num + 1]
-                return self.controller.generate_text_with_llm(selected, lq_img, hq_img)
+                return await self.controller.generate_text_with_llm(selected, lq_img, hq_img, tag)
 
-            def handle_page_change(current_page, delta, page_size, filter_status, user_state=None):
+            def handle_page_change(current_page, delta, page_size, filter_status, user_state=None, cursor=None):
                 new_page = int(current_page) + int(delta)
                 new_page = max(1, new_page)
-                data, total, _ = load_task_list(new_page, page_size, filter_status, user_state=user_state)
-                return data, total, new_page
+                data, total, _, new_cursor = load_task_list(new_page, page_size, filter_status, user_state=user_state, cursor=cursor)
+                return data, total, new_page, new_cursor
 
-            def search_task_by_id(task_id: str, user_state):
+            def search_task_by_id(task_id: str, user_state, full_resolution=False):
                 if not task_id or not task_id.strip():
                     return [None, None, None, "请输入任务ID"] + [self.annotation_options[a]["value"] for a in self.annotation_options.keys()] + [""]
                 
@@ -150,7 +155,7 @@ class ReviewUI:
                     if task_user_id != user_state:
                         return [None, None, None, f"无权访问任务 {task_id}"] + [self.annotation_options[a]["value"] for a in self.annotation_options.keys()] + [""]
 
-                result = self.controller.load_task_for_review(task_id.strip())
+                result = self.controller.load_task_for_review(task_id.strip(), full_resolution)
                 lq_img, hq_img, status_msg, opts, txt, err = result
                 
                 if err:
@@ -162,32 +167,44 @@ class ReviewUI:
                 ]
                 return [task_id.strip(), lq_img, hq_img, status_msg] + opt_vals + [txt]
 
+            def load_images(task_id, full_resolution):
+                return self.controller.load_task_images(task_id, full_resolution)
+
             def export_data_for_download(query_str):
                 return self.controller.export_data_for_download(query_str)
 
-            def import_data(file_obj):
+            def import_data(file_obj, overwrite):
                 if not file_obj:
                     return "请选择文件"
-                return self.controller.import_data(file_obj.name)
+                return self.controller.import_data(file_obj.name, overwrite)
 
             # Bind events
+            # 切换任务时取消进行中的生成请求
+            generate_event = generate_btn.click(
+                generate_text,
+                inputs=[task_id_input] + [selected_options[a] for a in self.annotation_options.keys()] + [lq_image, hq_image],
+                outputs=[user_text]
+            )
+
             refresh_list_btn.click(
                 load_task_list,
                 inputs=[page_num, page_size, filter_status, user_state],
-                outputs=[task_list, total_pages, page_num]
+                outputs=[task_list, total_pages, page_num, list_cursor]
             )
 
             task_list.select(
                 load_selected_task,
+                inputs=[full_res],
                 outputs=[task_id_input, status_msg, lq_image, hq_image] +
                         [selected_options[a] for a in self.annotation_options.keys()] +
-                        [user_text, update_status]
+                        [user_text, update_status],
+                cancels=[generate_event]
             )
 
-            generate_btn.click(
-                generate_text,
-                inputs=[selected_options[a] for a in self.annotation_options.keys()] + [lq_image, hq_image],
-                outputs=[user_text]
+            full_res.change(
+                load_images,
+                inputs=[task_id_input, full_res],
+                outputs=[lq_image, hq_image]
             )
 
             update_task_btn.click(
@@ -198,28 +215,29 @@ class ReviewUI:
 
             prev_page_btn.click(
                 handle_page_change,
-                inputs=[page_num, gr.Number(value=-1, visible=False), page_size, filter_status, user_state],
-                outputs=[task_list, total_pages, page_num]
+                inputs=[page_num, gr.Number(value=-1, visible=False), page_size, filter_status, user_state, list_cursor],
+                outputs=[task_list, total_pages, page_num, list_cursor]
             )
 
             next_page_btn.click(
                 handle_page_change,
-                inputs=[page_num, gr.Number(value=1, visible=False), page_size, filter_status, user_state],
-                outputs=[task_list, total_pages, page_num]
+                inputs=[page_num, gr.Number(value=1, visible=False), page_size, filter_status, user_state, list_cursor],
+                outputs=[task_list, total_pages, page_num, list_cursor]
             )
 
             jump_btn.click(
                 jump_to_page,
                 inputs=[page_num, page_size, filter_status, user_state],
-                outputs=[task_list, total_pages, page_num]
+                outputs=[task_list, total_pages, page_num, list_cursor]
             )
 
             search_btn.click(
                 search_task_by_id,
-                inputs=[search_task_id, user_state],
+                inputs=[search_task_id, user_state, full_res],
                 outputs=[task_id_input, lq_image, hq_image, status_msg] +
                     [selected_options[a] for a in self.annotation_options.keys()] +
-                    [user_text]
+                    [user_text],
+                cancels=[generate_event]
             )
 
             export_btn.click(
@@ -227,9 +245,9 @@ class ReviewUI:
                 inputs=[export_query],
                 outputs=[export_file_output, export_status]
             )
-            import_btn.click(import_data, inputs=[import_file], outputs=[import_status])
+            import_btn.click(import_data, inputs=[import_file, import_overwrite], outputs=[import_status])
 
             review_demo.load(load_task_list, inputs=[page_num, page_size, filter_status, user_state],
-                             outputs=[task_list, total_pages, page_num])
+                             outputs=[task_list, total_pages, page_num, list_cursor])
 
         return review_demo
\ No newline at end of file
@@ -6,6 +6,11 @@ from interfaces.review_ui import ReviewUI
 from interfaces.helper_ui import HelperUI
 
 import gradio as gr
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from utils.metrics import REGISTRY
+from utils.cli_utils import add_connection_arguments, connection_options
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Image Quality Annotation")
@@ -15,6 +20,12 @@ def parse_args():
     parser.add_argument('--db_name', type=str, default='annotation')
     parser.add_argument('--collection_name', type=str, default='annotations')
     parser.add_argument('--role', type=str, default='user')
+    parser.add_argument('--reaper_interval', type=float, default=30, help='过期租约回收间隔（秒）')
+    parser.add_argument('--reaper_batch_size', type=int, default=500, help='每批次回收的过期任务数量')
+    parser.add_argument('--prefetch_workers', type=int, default=4, help='预取下一张任务的线程数，0 表示关闭预取')
+    parser.add_argument('--command_monitoring', action='store_true', help='记录每条 MongoDB 命令并归属到界面操作')
+    parser.add_argument('--slow_command_ms', type=float, default=100, help='慢命令日志阈值（毫秒）')
+    add_connection_arguments(parser)
     args = parser.parse_args()
 
     return args
@@ -22,11 +33,15 @@ def parse_args():
 
 def main(args):
     # 初始化
-    db = Database(mongodb_uri=args.mongodb_uri, db_name=args.db_name, collection_name=args.collection_name)
+    db = Database(mongodb_uri=args.mongodb_uri, db_name=args.db_name, collection_name=args.collection_name,
+                  reaper_interval=args.reaper_interval, reaper_batch_size=args.reaper_batch_size,
+                  command_monitoring=args.command_monitoring, slow_command_ms=args.slow_command_ms,
+                  **connection_options(args))
+    db.start_lease_reaper()
 
     # 创建各 UI
     login_ui = LoginUI(db)
-    annotation_ui = AnnotationUI(db, args.role)
+    annotation_ui = AnnotationUI(db, args.role, prefetch_workers=args.prefetch_workers)
     review_ui = ReviewUI(db, args.role)
     help_ui = HelperUI()
 
@@ -43,12 +58,26 @@ def main(args):
         with gr.Tab("标注结果展示"):
             review_ui.create_interface(user_state)
 
-    app.launch(
-        server_name=args.server_name,
-        server_port=args.server_port,
-        debug=True,
-        show_error=True,
-    )
+    # gradio 挂载在 FastAPI 上，同一端口额外提供 /metrics
+    server = FastAPI()
+
+    @server.get("/metrics")
+    def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    if args.command_monitoring:
+        @server.get("/debug/commands")
+        def command_report():
+            return db.get_command_report()
+
+    server = gr.mount_gradio_app(server, app, path="/", show_error=True)
+
+    try:
+        uvicorn.run(server, host=args.server_name, port=args.server_port)
+    finally:
+        # 释放未使用的预领取任务
+        annotation_ui.controller.shutdown()
+        db.close_connection()
 
 if __name__ == "__main__":
     args = parse_args()
@@ -26,5 +26,6 @@ class AnnotationData:
     status: str = "pending"  # pending, annotating, annotated
     assigned_user: Optional[str] = None  # 当前正在标注的用户
     assigned_at: Optional[datetime] = None  # 分配时间
+    lease_expires_at: Optional[datetime] = None  # 租约过期时间
     updated_at: Optional[datetime] = None
     last_updated_by: Optional[str] = None
\ No newline at end of file
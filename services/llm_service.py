@@ -1,9 +1,48 @@
+import io
 import os
+import time
 import base64
-import tempfile
+import asyncio
+import logging
+import weakref
+import httpx
 from PIL import Image
-from openai import OpenAI
-from typing import List, Optional, Union, Tuple
+from openai import OpenAI, AsyncOpenAI
+from typing import Dict, Any, List, Optional, Union, Tuple
+
+from config import (LLM_BASE_URL, LLM_MODEL_NAME, LLM_API_KEY, LLM_ENABLED, LLM_MAX_CONCURRENCY, LLM_TIMEOUT, LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES,
+                    LLM_IMAGE_MAX_SIDE, LLM_IMAGE_FORMAT, LLM_IMAGE_QUALITY)
+from services.text_cache import TextCache, hash_image, make_cache_key
+from utils.metrics import REGISTRY, cache_samples
+
+logger = logging.getLogger(__name__)
+
+REGISTRY.describe("annotation_llm_request_seconds", "LLM 请求耗时（按结果分类）")
+REGISTRY.describe("annotation_llm_image_encode_seconds", "LLM 请求图像编码耗时")
+REGISTRY.describe("annotation_llm_payload_bytes", "LLM 请求图像负载大小",
+                  buckets=(64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6))
+
+# 修改提示词时同步修改版本号，使旧的缓存结果失效
+PROMPT_VERSION = "v1"
+SYS_PROMPT = "You are a professional expert in image quality assessment"
+USER_PROMPT_TEMPLATE = (
+    "The first image is the low-quality input and the second image is the restored result. "
+    "Scene: {tag}. Ratings: {ratings}. "
+    "Write a concise evaluation of the restored image that is consistent with these ratings."
+)
+# 预生成草稿时还没有评分。草稿使用独立的缓存命名空间：它基于缩略图、不带评分，
+# 与界面上按评分生成的请求不会命中同一条缓存
+DRAFT_PROMPT_VERSION = "draft-v1"
+DRAFT_PROMPT_TEMPLATE = (
+    "The first image is the low-quality input and the second image is the restored result. "
+    "Scene: {tag}. "
+    "Write a concise evaluation of the restored image."
+)
+
+LLM_DISABLED_MESSAGE = "未配置 LLM 服务，设置 LLM_API_KEY 或 LLM_BASE_URL 后可生成评价"
+
+class LLMResponseError(Exception):
+    """LLM 返回错误结果"""
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
@@ -17,34 +56,78 @@ def encode_image(image_path):
     }.get(ext, 'image/webp')
     return f"data:{mime_type};base64,{b64}"
 
+def encode_image_data(image, max_side: int = LLM_IMAGE_MAX_SIDE, fmt: str = LLM_IMAGE_FORMAT,
+                      quality: int = LLM_IMAGE_QUALITY) -> Tuple[str, Dict[str, Any]]:
+    """
+    在内存中将图像缩放并编码为 data URL，不经过文件系统
+
+    Args:
+        image: numpy 数组或 PIL 图像
+        max_side: 最长边，超过时等比缩小
+        fmt: 编码格式，jpeg 或 webp
+        quality: 编码质量
+
+    Returns:
+        Tuple[str, Dict]: data URL 以及编码信息（字节数、耗时、尺寸）
+    """
+    started = time.perf_counter()
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(image.astype('uint8'))
+    image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=quality)
+    b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    mime_type = "image/jpeg" if fmt.lower() in ("jpeg", "jpg") else f"image/{fmt.lower()}"
+    info = {
+        "bytes": len(b64),
+        "seconds": time.perf_counter() - started,
+        "width": image.width,
+        "height": image.height,
+    }
+    return f"data:{mime_type};base64,{b64}", info
+
+def _prepare_messages(
+    prompt: str,
+    imgs_path: Optional[List[str]],
+    sys_msgs: Optional[Union[str, List[str]]],
+    image_urls: Optional[List[str]] = None
+) -> List[dict]:
+    if isinstance(sys_msgs, str):
+        sys_msgs = [sys_msgs]
+    if sys_msgs is None:
+        sys_msgs_content = [{"role": "system", "content": [{"type": "text", "text": SYS_PROMPT}]}]
+    else:
+        sys_msgs_content = [{"role": "system", "content": [{"type": "text", "text": s}]} for s in sys_msgs]
+
+    image_msgs = []
+    if imgs_path:
+        image_msgs = [{"type": "image_url", "image_url": {"url": encode_image(path)}} for path in imgs_path]
+    if image_urls:
+        image_msgs += [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+
+    user_msg = {'role': 'user', 'content': [{'type': 'text', 'text': prompt}] + image_msgs}
+    return sys_msgs_content + [user_msg]
+
 class LLMClient:
-    def __init__(self, model: str):
+    def __init__(self, model: str = LLM_MODEL_NAME, base_url: str = LLM_BASE_URL, api_key: str = LLM_API_KEY):
         self.model = model
         self.client = OpenAI(
-            api_key="",
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            api_key=api_key,
+            base_url=base_url,
         )
-    
+
     def _prepare_messages(
         self,
         prompt: str,
         imgs_path: Optional[List[str]],
         sys_msgs: Optional[Union[str, List[str]]]
     ) -> List[dict]:
-        if isinstance(sys_msgs, str):
-            sys_msgs = [sys_msgs]
-        if sys_msgs is None:
-            sys_msgs_content = [{"role": "system", "content": [{"type": "text", "text": "You are a professional expert in image quality assessment"}]}]
-        else:
-            sys_msgs_content = [{"role": "system", "content": [{"type": "text", "text": s}]} for s in sys_msgs]
-
-        image_msgs = []
-        if imgs_path:
-            image_msgs = [{"type": "image_url", "image_url": {"url": encode_image(path)}} for path in imgs_path]
+        return _prepare_messages(prompt, imgs_path, sys_msgs)
 
-        user_msg = {'role': 'user', 'content': [{'type': 'text', 'text': prompt}] + image_msgs}
-        return sys_msgs_content + [user_msg]
-    
     def get_response(
         self,
         prompt: str,
@@ -55,44 +138,196 @@ class LLMClient:
 
         try:
             completion = self.client.chat.completions.create(model=self.model, messages=msg)
-            resp = completion.choices[3].message
-            
+            resp = completion.choices[0].message
+
             content = resp.content or "No content available"
             return content
         except Exception as e:
             return f"Error: {e}"
 
-def generate_text(selected_options, lq_image, hq_image, tag):
-        temp_paths = []
+class AsyncLLMClient:
+    """
+    基于共享 HTTP 连接池的异步 LLM 客户端
+
+    所有请求共用一个 httpx.AsyncClient，并由信号量限制同时进行中的请求数量；
+    请求所在任务被取消（例如用户切换任务）时，底层 HTTP 请求随之取消。
+    连接池与信号量绑定在创建它的事件循环上，只能在该事件循环中使用。
+    """
+    def __init__(self, model: str = LLM_MODEL_NAME, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT, base_url: str = LLM_BASE_URL, api_key: str = LLM_API_KEY):
+        self.model = model
+        self.timeout = timeout
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=httpx.Timeout(timeout)
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self.http_client,
+            max_retries=0,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def get_response(
+        self,
+        prompt: str,
+        imgs_path: Optional[List[str]] = None,
+        sys_msgs: Optional[Union[str, List[str]]] = None,
+        timeout: Optional[float] = None,
+        image_urls: Optional[List[str]] = None,
+    ) -> str:
+        if imgs_path:
+            msg = await asyncio.to_thread(_prepare_messages, prompt, imgs_path, sys_msgs, image_urls)
+        else:
+            msg = _prepare_messages(prompt, None, sys_msgs, image_urls)
+
+        outcome = "ok"
+        started = None
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                completion = await asyncio.wait_for(
+                    self.client.chat.completions.create(model=self.model, messages=msg),
+                    timeout or self.timeout
+                )
+            resp = completion.choices[0].message
+            return resp.content or "No content available"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            return f"Error: 请求超时（{timeout or self.timeout}s）"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "error"
+            return f"Error: {e}"
+        finally:
+            if started is not None:
+                REGISTRY.observe("annotation_llm_request_seconds", time.perf_counter() - started, outcome=outcome)
+
+    async def close(self):
+        await self.client.close()
+
+# 事件循环 -> AsyncLLMClient：每个事件循环各自持有客户端
+_async_clients = weakref.WeakKeyDictionary()
+_text_cache = None
+
+def get_text_cache() -> TextCache:
+    global _text_cache
+    if _text_cache is None:
+        _text_cache = TextCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES)
+        REGISTRY.register_collector("llm_text_cache", lambda: cache_samples("llm_text", _text_cache.stats()))
+    return _text_cache
+
+def get_text_cache_stats():
+    return get_text_cache().stats()
+
+def llm_enabled() -> bool:
+    """配置了密钥或服务地址，或当前事件循环显式指定了客户端时才调用 LLM"""
+    if LLM_ENABLED:
+        return True
+    try:
+        return asyncio.get_running_loop() in _async_clients
+    except RuntimeError:
+        return False
+
+def get_async_llm_client() -> AsyncLLMClient:
+    """当前事件循环共享的异步客户端，首次使用时创建"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncLLMClient(LLM_MODEL_NAME)
+    return client
+
+def set_async_llm_client(client: AsyncLLMClient):
+    """为当前事件循环指定异步客户端（例如压测时指定并发数与服务地址），需在该事件循环中调用"""
+    _async_clients[asyncio.get_running_loop()] = client
+
+async def close_async_llm_client():
+    """关闭并移除当前事件循环的异步客户端"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+def _encode_pair(lq_image, hq_image) -> Tuple[List[str], Dict[str, Any]]:
+    urls = []
+    total = {"bytes": 0, "seconds": 0.0}
+    for image in (lq_image, hq_image):
+        url, info = encode_image_data(image)
+        urls.append(url)
+        total["bytes"] += info["bytes"]
+        total["seconds"] += info["seconds"]
+    return urls, total
+
+async def _generate_cached(selected_options, lq_image, hq_image, tag) -> str:
+    """
+    生成评价文本，先查内容寻址缓存；selected_options 为空时使用草稿提示词与草稿缓存命名空间
+
+    Raises:
+        LLMResponseError: LLM 返回错误
+    """
+    if not llm_enabled():
+        raise LLMResponseError(LLM_DISABLED_MESSAGE)
+    client = get_async_llm_client()
+    cache = get_text_cache()
+    lq_hash, hq_hash = await asyncio.to_thread(lambda: (hash_image(lq_image), hash_image(hq_image)))
+    prompt_version = PROMPT_VERSION if selected_options else DRAFT_PROMPT_VERSION
+    cache_key = make_cache_key(lq_hash, hq_hash, selected_options or {}, tag, client.model, prompt_version)
+    cached = await asyncio.to_thread(cache.get, cache_key)
+    if cached is not None:
+        logger.info(f"生成文本缓存命中，命中率 {cache.stats()['hit_rate']:.1%}")
+        return cached
+
+    image_urls, encode_info = await asyncio.to_thread(_encode_pair, lq_image, hq_image)
+    REGISTRY.observe("annotation_llm_image_encode_seconds", encode_info['seconds'])
+    REGISTRY.observe("annotation_llm_payload_bytes", encode_info['bytes'])
+    logger.info(f"图像编码完成: 请求图像负载 {encode_info['bytes'] / 1024:.1f} KB，编码耗时 {encode_info['seconds'] * 1000:.1f} ms")
+
+    if selected_options:
+        rating_text = "; ".join(f"{k}: {v}" for k, v in selected_options.items())
+        user_prompt = USER_PROMPT_TEMPLATE.format(tag=tag, ratings=rating_text)
+    else:
+        user_prompt = DRAFT_PROMPT_TEMPLATE.format(tag=tag)
+
+    response = await client.get_response(
+        prompt=user_prompt,
+        sys_msgs=SYS_PROMPT,
+        image_urls=image_urls
+    )
+    if isinstance(response, str) and response.startswith("Error:"):
+        raise LLMResponseError(response)
+    try:
+        await asyncio.to_thread(cache.put, cache_key, response, model=client.model, prompt_version=prompt_version)
+    except OSError as e:
+        logger.warning(f"写入生成文本缓存失败: {e}")
+    return response
+
+async def generate_text(selected_options, lq_image, hq_image, tag):
         try:
             if lq_image is None or hq_image is None:
                 return "图像数据为空，无法生成评价"
-
-            temp_dir = os.environ.get('GRADIO_TEMP_DIR', tempfile.gettempdir())
-            with tempfile.NamedTemporaryFile(dir=temp_dir, suffix=".png", delete=False) as f:
-                lq_path = f.name
-            with tempfile.NamedTemporaryFile(dir=temp_dir, suffix=".png", delete=False) as f:
-                hq_path = f.name
-
-            Image.fromarray(lq_image.astype('uint8')).save(lq_path)
-            Image.fromarray(hq_image.astype('uint8')).save(hq_path)
-            temp_paths = [lq_path, hq_path]
-
-            sys_prompt = ""
-            rating_text = "; ".join(f"{k}: {v}" for k, v in selected_options.items())
-            user_prompt = f"""
-                """
-            
-            return "Empty"
-            # response = Qwen3.get_response(
-            #     prompt=user_prompt,
-            #     imgs_path=[lq_path, hq_path],
-            #     sys_msgs=sys_prompt
-            # )
-            # return response if not (isinstance(response, str) and response.startswith("Error:")) else f"AI生成评价失败: {response}"
+            if not llm_enabled():
+                return LLM_DISABLED_MESSAGE
+            return await _generate_cached(selected_options, lq_image, hq_image, tag)
+        except LLMResponseError as e:
+            return f"AI生成评价失败: {e}"
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             return f"生成文本时出错: {str(e)}"
-        finally:
-            for p in temp_paths:
-                if os.path.exists(p):
-                    os.remove(p)
\ No newline at end of file
+
+async def generate_draft_text(lq_image, hq_image, tag) -> Optional[str]:
+    """
+    不依赖评分生成评价草稿，供离线预生成使用
+
+    Returns:
+        Optional[str]: 生成的文本，失败时返回None
+    """
+    try:
+        return await _generate_cached(None, lq_image, hq_image, tag)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"生成评价草稿失败: {e}")
+        return None
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+def hash_image(image) -> str:
+    """按像素内容计算图像哈希（支持 numpy 数组与 PIL 图像）"""
+    h = hashlib.sha256()
+    if hasattr(image, "tobytes") and hasattr(image, "shape"):
+        h.update(f"{image.shape}:{image.dtype}".encode("utf-8"))
+    else:
+        h.update(f"{image.size}:{image.mode}".encode("utf-8"))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+def make_cache_key(lq_hash: str, hq_hash: str, ratings: Dict[str, Any], tag: str,
+                   model: str, prompt_version: str) -> str:
+    payload = json.dumps(
+        [lq_hash, hq_hash, sorted((str(k), v) for k, v in ratings.items()), tag, model, prompt_version],
+        ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class TextCache:
+    """
+    按内容寻址的磁盘缓存，保存已生成的评价文本
+
+    每个条目为一个JSON文件，总大小超过 max_bytes 时按最近访问时间淘汰。
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = {}  # path -> (size, last_access)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                self._entries[path] = (stat.st_size, stat.st_mtime)
+                self.current_bytes += stat.st_size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if path in self._entries:
+                self._entries[path] = (self._entries[path][0], now)
+        return text
+
+    def put(self, key: str, text: str, **extra):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"text": text, "created_at": time.time(), **extra}, ensure_ascii=False)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._entries.get(path)
+            if old:
+                self.current_bytes -= old[0]
+            self._entries[path] = (size, time.time())
+            self.current_bytes += size
+            self._evict()
+
+    def _evict(self):
+        if self.current_bytes <= self.max_bytes:
+            return
+        for path, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if self.current_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            del self._entries[path]
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,142 @@
+import copy
+
+import pytest
+
+pytest.importorskip("pymongo")
+from pymongo.errors import DuplicateKeyError
+
+from database.counter_repository import CounterRepository
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def _set(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _matches(doc, query):
+    for path, expected in query.items():
+        value = _get(doc, path)
+        if isinstance(expected, dict) and "$in" in expected:
+            if value not in expected["$in"]:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class FakeCounterCollection:
+    """只实现 CounterRepository 用到的操作的内存集合"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def find_one(self, query):
+        doc = self.docs.get(query["_id"])
+        return copy.deepcopy(doc) if doc is not None and _matches(doc, query) else None
+
+    def _apply(self, doc, update):
+        for path, value in update.get("$set", {}).items():
+            _set(doc, path, value)
+        for path, value in update.get("$inc", {}).items():
+            _set(doc, path, (_get(doc, path) or 0) + value)
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.get(query["_id"])
+        if doc is None or not _matches(doc, query):
+            if not upsert:
+                return
+            if doc is not None:
+                raise DuplicateKeyError("E11000 duplicate key")
+            doc = self.docs[query["_id"]] = {"_id": query["_id"]}
+        self._apply(doc, update)
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self.update_one(query, update, upsert=upsert)
+        return copy.deepcopy(self.docs.get(query["_id"]))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.collection = FakeCounterCollection()
+
+    def get_collection(self, name):
+        return self.collection
+
+
+class FakeAnnotationCollection:
+    """aggregate 按 (status, tag, method) 分组计数，可在读取数据后注入并发操作"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.during_aggregate = None
+
+    def aggregate(self, pipeline):
+        groups = {}
+        for doc in self.docs:
+            key = (doc["status"], doc["tag"], doc["metadata"]["method_name"])
+            groups[key] = groups.get(key, 0) + 1
+        rows = [{"_id": {"status": s, "tag": t, "method": m}, "count": c}
+                for (s, t, m), c in groups.items()]
+        if self.during_aggregate:
+            self.during_aggregate()
+        return iter(rows)
+
+
+def _doc(status, tag="a", method="m1"):
+    return {"status": status, "tag": tag, "metadata": {"method_name": method}}
+
+
+def _transition(counters, doc, to_status):
+    counters.record_transition(doc["status"], to_status, doc)
+    doc["status"] = to_status
+
+
+def test_recompute_keeps_increment_made_during_aggregate():
+    docs = [_doc("pending"), _doc("pending"), _doc("annotated", tag="b")]
+    annotations = FakeAnnotationCollection(docs)
+    counters = CounterRepository(FakeConnection(), "counters")
+
+    # 计数器尚未初始化时产生的增量只留下残缺文档，get 不返回它
+    _transition(counters, docs[0], "annotating")
+    assert counters.get() is None
+
+    # 重算读完标注数据后、写回计数之前，另一个请求完成了一次状态变化
+    annotations.during_aggregate = lambda: _transition(counters, docs[1], "annotating")
+    result = counters.recompute(annotations)
+    annotations.during_aggregate = None
+
+    stored = counters.get()
+    assert stored["global"] == {"pending": 0, "annotating": 2, "annotated": 1}
+    assert stored["tags"]["a"] == {"pending": 0, "annotating": 2}
+    assert result["drift"] == {"global.pending": 2, "global.annotated": 1,
+                               "tags.a.pending": 2, "tags.b.annotated": 1,
+                               "methods.m1.pending": 2, "methods.m1.annotated": 1}
+
+    # 重算之后的增量照常生效
+    _transition(counters, docs[0], "annotated")
+    assert counters.get()["global"] == {"pending": 0, "annotating": 1, "annotated": 2}
+
+
+def test_concurrent_recompute_applies_correction_once():
+    docs = [_doc("pending"), _doc("annotated")]
+    annotations = FakeAnnotationCollection(docs)
+    counters = CounterRepository(FakeConnection(), "counters")
+
+    # 第一个重算读取快照并聚合时，第二个重算完整地执行完毕
+    annotations.during_aggregate = lambda: (
+        setattr(annotations, "during_aggregate", None), counters.recompute(annotations))
+    result = counters.recompute(annotations)
+
+    assert result["drift"] == {}
+    assert counters.get()["global"] == {"pending": 1, "annotated": 1}
+    assert counters.get()["recompute_epoch"] == 1
@@ -0,0 +1,29 @@
+# utils/cli_utils.py
+import argparse
+from typing import Dict, Any
+
+def add_connection_arguments(parser: argparse.ArgumentParser):
+    """添加 MongoDB 连接池、超时、压缩与读偏好参数"""
+    group = parser.add_argument_group("MongoDB 连接")
+    group.add_argument('--max_pool_size', type=int, default=100, help='连接池最大连接数')
+    group.add_argument('--min_pool_size', type=int, default=0, help='连接池最小连接数')
+    group.add_argument('--server_selection_timeout_ms', type=int, default=30000, help='选择服务器超时（毫秒）')
+    group.add_argument('--connect_timeout_ms', type=int, default=20000, help='建立连接超时（毫秒）')
+    group.add_argument('--socket_timeout_ms', type=int, default=None, help='读写超时（毫秒），默认不限制')
+    group.add_argument('--compressors', type=str, nargs='*', default=None, choices=['zstd', 'snappy', 'zlib'],
+                       help='网络压缩算法，按优先级排列')
+    group.add_argument('--read_preference', type=str, default='primary',
+                       choices=['primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest'],
+                       help='审查列表与导出等只读查询的读偏好')
+
+def connection_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """把命令行参数转换为 Database 的构造参数"""
+    return {
+        'max_pool_size': args.max_pool_size,
+        'min_pool_size': args.min_pool_size,
+        'server_selection_timeout_ms': args.server_selection_timeout_ms,
+        'connect_timeout_ms': args.connect_timeout_ms,
+        'socket_timeout_ms': args.socket_timeout_ms,
+        'compressors': args.compressors,
+        'read_preference': args.read_preference,
+    }
@@ -1,20 +1,201 @@
 # utils/image_utils.py
 import cv2
 import os
-from typing import List, Optional
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 from PIL import Image
 
+from config import IMAGE_CACHE_MAX_BYTES
+from utils.metrics import REGISTRY, cache_samples
+
+class ImageCache:
+    """按 (路径, mtime) 缓存解码后的图像，超出字节预算时按 LRU 淘汰"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, image: Image.Image):
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                return
+            self._data[key] = (image, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._data),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+image_cache = ImageCache(IMAGE_CACHE_MAX_BYTES)
+REGISTRY.register_collector("image_cache", lambda: cache_samples("image", image_cache.stats()))
+REGISTRY.describe("annotation_image_decode_seconds", "图像解码耗时（未命中缓存时）")
+
+def get_image_cache_stats() -> Dict[str, Any]:
+    return image_cache.stats()
+
 def open_image(image_path: str) -> Optional[Image.Image]:
     try:
         if not os.path.exists(image_path):
             print(f"图像文件不存在: {image_path}")
             return None
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"无法读取图像: {image_path}")
-            return None
-        
-        return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        stat = os.stat(image_path)
+        key = (image_path, stat.st_mtime_ns, stat.st_size)
+        cached = image_cache.get(key)
+        if cached is not None:
+            return cached
+
+        with REGISTRY.timer("annotation_image_decode"):
+            image = cv2.imread(image_path)
+            if image is None:
+                print(f"无法读取图像: {image_path}")
+                return None
+
+            pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        image_cache.put(key, pil_image)
+        return pil_image
     except Exception as e:
         print(f"读取图像时出错: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def make_rendition(image_path: str, output_dir: str, max_side: int = 800,
+                   fmt: str = "webp", quality: int = 85) -> Optional[Dict[str, Any]]:
+    """
+    生成用于界面展示的缩小版图像
+
+    Args:
+        image_path: 原图路径
+        output_dir: 缩略图输出目录
+        max_side: 缩略图最长边
+        fmt: 输出格式，webp 或 jpeg
+        quality: 压缩质量
+
+    Returns:
+        Optional[Dict]: 缩略图路径及其尺寸、原图尺寸，失败时返回None
+    """
+    try:
+        stat = os.stat(image_path)
+        # 文件名包含全部生成参数，参数变化时不会复用旧的缩略图
+        key = f"{os.path.abspath(image_path)}:{stat.st_mtime_ns}:{max_side}:{fmt}:{quality}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        ext = "jpg" if fmt == "jpeg" else fmt
+        output_path = os.path.abspath(os.path.join(output_dir, f"{digest}.{ext}"))
+
+        with Image.open(image_path) as image:
+            original_width, original_height = image.size
+            if os.path.exists(output_path):
+                with Image.open(output_path) as existing:
+                    width, height = existing.size
+            else:
+                rendition = image.convert("RGB")
+                rendition.thumbnail((max_side, max_side), Image.LANCZOS)
+                rendition.save(output_path, format=fmt.upper(), quality=quality)
+                width, height = rendition.size
+
+        return {
+            "path": output_path,
+            "width": width,
+            "height": height,
+            "original_width": original_width,
+            "original_height": original_height,
+        }
+    except Exception as e:
+        print(f"生成缩略图时出错: {image_path}, {e}")
+        return None
+
+def compute_image_hashes(image_path: str, hash_size: int = 8) -> Optional[Dict[str, Any]]:
+    """
+    计算图像的内容哈希与感知哈希（dHash）
+
+    内容哈希基于解码后的像素，编码方式不同但像素相同的文件也会得到相同结果；
+    dHash 比较缩小后灰度图相邻像素的明暗，用于识别几乎相同的图像。
+
+    Args:
+        image_path: 图像路径
+        hash_size: dHash 的边长，得到 hash_size * hash_size 位
+
+    Returns:
+        Optional[Dict]: content_hash、dhash（十六进制）与图像尺寸，失败时返回None
+    """
+    try:
+        with Image.open(image_path) as image:
+            rgb = image.convert("RGB")
+        content = hashlib.sha256(f"{rgb.size}".encode("utf-8"))
+        content.update(rgb.tobytes())
+
+        gray = rgb.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = list(gray.getdata())
+        bits = 0
+        for row in range(hash_size):
+            for col in range(hash_size):
+                left = pixels[row * (hash_size + 1) + col]
+                right = pixels[row * (hash_size + 1) + col + 1]
+                bits = (bits << 1) | (1 if left > right else 0)
+
+        return {
+            "content_hash": content.hexdigest(),
+            "dhash": f"{bits:0{hash_size * hash_size // 4}x}",
+            "width": rgb.width,
+            "height": rgb.height,
+        }
+    except Exception as e:
+        print(f"计算图像哈希时出错: {image_path}, {e}")
+        return None
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """两个十六进制哈希之间不同的位数"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+def open_task_images(task: Dict[str, Any], full_resolution: bool = False):
+    """
+    打开任务的 LQ/HQ 图像，默认优先使用导入时生成的缩略图
+
+    Returns:
+        Tuple[Optional[Image.Image], Optional[Image.Image]]: (LQ, HQ)
+    """
+    renditions = task.get('renditions') or {}
+    images = []
+    for which in ('lq', 'hq'):
+        path = task[f'{which}_image_path']
+        rendition_path = (renditions.get(which) or {}).get('path')
+        if not full_resolution and rendition_path and os.path.exists(rendition_path):
+            path = rendition_path
+        images.append(open_image(path))
+    return tuple(images)
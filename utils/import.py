@@ -1,68 +1,230 @@
 import os
 import json
+import hashlib
 import argparse
+from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Any
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Any, Tuple
 
 from database import Database
+from utils.cli_utils import add_connection_arguments, connection_options
+from utils.image_utils import make_rendition, compute_image_hashes, hamming_distance
 
 def load_json(json_file_path: str) -> Dict[str, Any]:
     """读取JSON配置文件"""
     with open(json_file_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def generate_annotation_pairs(json_config: Dict[str, Any], file_json: str) -> List[Dict[str, Any]]:
-    """根据JSON配置生成标注数据对"""
-    pairs = []
-    
+def scan_directory(root: str, rel_dirs) -> set:
+    """
+    用 os.scandir 列出目录（及文件名中包含的子目录）一次，返回存在的文件相对路径集合
+
+    Args:
+        root: 根目录
+        rel_dirs: 需要列出的相对子目录，'' 表示根目录本身
+
+    Returns:
+        set: 存在的文件相对路径
+    """
+    present = set()
+    for rel_dir in rel_dirs:
+        try:
+            with os.scandir(os.path.join(root, rel_dir)) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        present.add(os.path.join(rel_dir, entry.name) if rel_dir else entry.name)
+        except FileNotFoundError:
+            continue
+    return present
+
+def generate_annotation_pairs(json_config: Dict[str, Any], file_json: str,
+                              scan_workers: int = 8) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    根据JSON配置生成标注数据对
+
+    每个方法目录只用 os.scandir 列出一次，在线程池中并行扫描，
+    之后的存在性判断都在内存中的集合上完成。
+
+    Args:
+        json_config: 数据集配置
+        file_json: 图像列表JSON路径
+        scan_workers: 并行扫描目录的线程数
+
+    Returns:
+        Tuple[List[Dict], Dict]: 标注数据对，以及缺失文件汇总
+    """
     lq_path = json_config['lq_path']
     methods = json_config['methods']
-    
-
     annotation_list = load_json(file_json)
-    for item in annotation_list:
-        image_filename = item['image']
 
-        lq_img_path = os.path.join(lq_path, image_filename)
+    filenames = [item['image'] for item in annotation_list]
+    rel_dirs = {os.path.dirname(os.path.normpath(name)) for name in filenames}
+    roots = [lq_path] + [method['path'] for method in methods]
+    with ThreadPoolExecutor(max_workers=scan_workers) as executor:
+        indexes = dict(zip(roots, executor.map(lambda root: scan_directory(root, rel_dirs), roots)))
+
+    def present(root: str, filename: str) -> bool:
+        return os.path.normpath(filename) in indexes[root]
+
+    lq_abs = Path(lq_path).absolute()
+    method_abs = {method['name']: Path(method['path']).absolute() for method in methods}
+    summary = {
+        'images': len(annotation_list),
+        'missing_lq': [],
+        'missing_hq': {method['name']: [] for method in methods},
+    }
 
-        if not os.path.exists(lq_img_path):
-            print(f"警告: LQ图像不存在 - {lq_img_path}")
+    pairs = []
+    for item in annotation_list:
+        image_filename = item['image']
+        if not present(lq_path, image_filename):
+            summary['missing_lq'].append(image_filename)
             continue
-        
+
+        meta_data = {
+            k: v for k, v in item.items()
+            if k not in {'image'}
+        }
         for method in methods:
             method_name = method['name']
-            method_path = method['path']
-            hq_img_path = os.path.join(method_path, image_filename)
-
-            if not os.path.exists(hq_img_path):
-                print(f"警告: HQ图像不存在 - {hq_img_path}")
+            if not present(method['path'], image_filename):
+                summary['missing_hq'][method_name].append(image_filename)
                 continue
-            
-            meta_data = {
-                k: v for k, v in item.items()
-                if k not in {'image'}
-            }
-
-            pair_data = {
-                'lq_image_path': str(Path(lq_img_path).absolute()),
-                'hq_image_path': str(Path(hq_img_path).absolute()),
-                'meta_data': meta_data,
+
+            pairs.append({
+                'lq_image_path': str(lq_abs / image_filename),
+                'hq_image_path': str(method_abs[method_name] / image_filename),
+                'meta_data': dict(meta_data),
                 'method_name': method_name,
                 'image_name': image_filename,
                 'status': 'pending',
-            }
+            })
 
-            pairs.append(pair_data)
-    
-    return pairs
+    summary['pairs'] = len(pairs)
+    return pairs, summary
+
+def print_missing_summary(summary: Dict[str, Any], examples: int = 5):
+    """按方法汇总打印缺失文件数量与示例"""
+    missing_lq = summary['missing_lq']
+    missing_hq = {name: files for name, files in summary['missing_hq'].items() if files}
+    if not missing_lq and not missing_hq:
+        print(f"全部 {summary['images']} 张图像的 LQ/HQ 文件均存在")
+        return
+    if missing_lq:
+        print(f"警告: {len(missing_lq)} 张 LQ 图像不存在，例如 {missing_lq[:examples]}")
+    for name, files in missing_hq.items():
+        print(f"警告: 方法 {name} 缺少 {len(files)} 张 HQ 图像，例如 {files[:examples]}")
+
+def generate_renditions(pairs: List[Dict[str, Any]], output_dir: str, max_side: int = 800,
+                        fmt: str = "webp", quality: int = 85, workers: int = None):
+    """为每个数据对的 LQ/HQ 图像生成展示用缩略图，并记录到 pair['renditions']"""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = sorted({p for pair in pairs for p in (pair['lq_image_path'], pair['hq_image_path'])})
+    render = partial(make_rendition, output_dir=output_dir, max_side=max_side, fmt=fmt, quality=quality)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        renditions = dict(zip(paths, executor.map(render, paths, chunksize=16)))
+
+    failed = 0
+    for pair in pairs:
+        lq = renditions.get(pair['lq_image_path'])
+        hq = renditions.get(pair['hq_image_path'])
+        if lq and hq:
+            pair['renditions'] = {'lq': lq, 'hq': hq}
+        else:
+            failed += 1
+    print(f"缩略图生成完成：{len(paths)} 张图像，{failed} 个数据对未能生成缩略图")
+
+def group_duplicate_pairs(pairs: List[Dict[str, Any]], workers: int = None,
+                          dhash_threshold: int = None) -> Dict[str, int]:
+    """
+    在进程池中计算 HQ 图像的内容哈希与 dHash，把同一 LQ 下重复的 HQ 结果分为一组
+
+    哈希写入 pair['meta_data']。每组只保留第一个数据对作为代表，其余标记为 duplicate 状态，
+    不会被领取，代表标注完成后结果同步到整组。重新导入时，已存在的代表数据会补写组信息，
+    代表已经标注完成的组，新插入的重复数据立即获得其标注结果。
+
+    Args:
+        pairs: 标注数据对
+        workers: 进程数
+        dhash_threshold: 为None时只合并像素完全相同的图像；否则尺寸相同且
+                         dHash 汉明距离不超过该值的图像也视为重复
+
+    Returns:
+        Dict[str, int]: 分组数量与被标记为重复的数据对数量
+    """
+    paths = sorted({pair['hq_image_path'] for pair in pairs})
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashes = dict(zip(paths, executor.map(compute_image_hashes, paths, chunksize=16)))
 
-def initialize_database(json_config_path: str, annotation_json_dir: str, db_interface: Database):
+    by_lq = defaultdict(list)
+    for index, pair in enumerate(pairs):
+        image_hashes = hashes.get(pair['hq_image_path'])
+        if image_hashes:
+            pair['meta_data']['content_hash'] = image_hashes['content_hash']
+            pair['meta_data']['dhash'] = image_hashes['dhash']
+            by_lq[pair['lq_image_path']].append(index)
+
+    def is_duplicate(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        if a['content_hash'] == b['content_hash']:
+            return True
+        return (dhash_threshold is not None
+                and (a['width'], a['height']) == (b['width'], b['height'])
+                and hamming_distance(a['dhash'], b['dhash']) <= dhash_threshold)
+
+    groups = 0
+    duplicates = 0
+    for indexes in by_lq.values():
+        # 并查集合并同一 LQ 下的重复结果，代表为组内最靠前的数据对
+        parent = {i: i for i in indexes}
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for pos, i in enumerate(indexes):
+            for j in indexes[pos + 1:]:
+                if is_duplicate(hashes[pairs[i]['hq_image_path']], hashes[pairs[j]['hq_image_path']]):
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        members = defaultdict(list)
+        for i in indexes:
+            members[find(i)].append(i)
+        for representative, group in members.items():
+            if len(group) < 2:
+                continue
+            groups += 1
+            rep_pair = pairs[representative]
+            dup_group = hashlib.sha1(f"{rep_pair['lq_image_path']}\0{rep_pair['hq_image_path']}".encode("utf-8")).hexdigest()[:16]
+            for i in group:
+                pairs[i]['meta_data']['dup_group'] = dup_group
+                pairs[i]['meta_data']['dup_representative'] = i == representative
+                if i != representative:
+                    pairs[i]['status'] = 'duplicate'
+                    duplicates += 1
+
+    print(f"重复检测完成：{len(paths)} 张 HQ 图像，{groups} 个重复组，{duplicates} 个数据对标记为重复")
+    return {'groups': groups, 'duplicates': duplicates}
+
+def initialize_database(json_config_path: str, annotation_json_dir: str, db_interface: Database, chunk_size: int = 1000,
+                        rendition_args: Dict[str, Any] = None, scan_workers: int = 8, missing_report: str = None,
+                        dedupe_args: Dict[str, Any] = None):
     """初始化数据库"""
     print("开始读取JSON配置文件...")
     config = load_json(json_config_path)
     
     print("生成标注数据对...")
-    pairs = generate_annotation_pairs(config, annotation_json_dir)
+    pairs, summary = generate_annotation_pairs(config, annotation_json_dir, scan_workers)
+    print_missing_summary(summary)
+    if missing_report:
+        with open(missing_report, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"缺失文件清单已写入 {missing_report}")
     
     print(f"找到 {len(pairs)} 个标注数据对")
     
@@ -70,9 +232,19 @@ def initialize_database(json_config_path: str, annotation_json_dir: str, db_inte
         print("没有有效的标注对，跳过数据库初始化。")
         return
     
+    if dedupe_args:
+        print("计算图像哈希并检测重复结果...")
+        group_duplicate_pairs(pairs, **dedupe_args)
+
+    if rendition_args:
+        print("生成展示用缩略图...")
+        generate_renditions(pairs, **rendition_args)
+
     # 插入到数据库
     print("正在插入/更新数据库...")
-    result = db_interface.initialize(pairs, tag_name='scene')
+    result = db_interface.initialize(pairs, tag_name='scene', chunk_size=chunk_size)
+    for chunk in result['chunks']:
+        print(f"  批次 {chunk['offset']}: 插入 {chunk['inserted']}，跳过 {chunk['skipped']}")
     
     inserted = result['inserted']
     skipped = result['skipped']
@@ -82,17 +254,49 @@ def initialize_database(json_config_path: str, annotation_json_dir: str, db_inte
 def main():
     parser = argparse.ArgumentParser(description="初始化图像修复标注数据库")
     parser.add_argument('--json_config_path', type=str, required=True)
+    parser.add_argument('--mongodb_uri', type=str, default='mongodb://localhost:27017/')
+    parser.add_argument('--db_name', type=str, default='annotation')
+    parser.add_argument('--collection_name', type=str, default='annotations')
     parser.add_argument('--files_json_path', type=str, required=True)
+    parser.add_argument('--chunk_size', type=int, default=1000, help='每批次批量写入的数据对数量')
+    parser.add_argument('--rendition_dir', type=str, default=None, help='展示用缩略图输出目录，不设置则不生成')
+    parser.add_argument('--rendition_max_side', type=int, default=800, help='缩略图最长边')
+    parser.add_argument('--rendition_format', type=str, default='webp', choices=['webp', 'jpeg'])
+    parser.add_argument('--rendition_quality', type=int, default=85)
+    parser.add_argument('--workers', type=int, default=None, help='生成缩略图与计算图像哈希的进程数')
+    parser.add_argument('--scan_workers', type=int, default=8, help='并行扫描图像目录的线程数')
+    parser.add_argument('--missing_report', type=str, default=None, help='缺失文件清单JSON输出路径')
+    parser.add_argument('--dedupe', action='store_true', help='计算HQ图像哈希并合并同一LQ下的重复结果')
+    parser.add_argument('--dhash_threshold', type=int, default=None,
+                        help='dHash 汉明距离阈值，不设置时只合并像素完全相同的结果')
+    add_connection_arguments(parser)
     args = parser.parse_args()
+    rendition_args = None
+    if args.rendition_dir:
+        rendition_args = {
+            'output_dir': args.rendition_dir,
+            'max_side': args.rendition_max_side,
+            'fmt': args.rendition_format,
+            'quality': args.rendition_quality,
+            'workers': args.workers,
+        }
+    dedupe_args = None
+    if args.dedupe:
+        dedupe_args = {'workers': args.workers, 'dhash_threshold': args.dhash_threshold}
     # 配置参数
     db_interface = Database(
-        mongodb_uri="mongodb://localhost:27017/",
-        db_name="annotation",
-        collection_name="annotations"
+        mongodb_uri=args.mongodb_uri,
+        db_name=args.db_name,
+        collection_name=args.collection_name,
+        background_bootstrap=False,
+        **connection_options(args)
     )
+    # 导入依赖唯一索引去重，写入前同步完成索引初始化，服务不可用时在这里报错退出
+    db_interface.ensure_schema()
     
     # 初始化数据库
-    initialize_database(args.json_config_path, args.files_json_path, db_interface)
+    initialize_database(args.json_config_path, args.files_json_path, db_interface, args.chunk_size, rendition_args,
+                        args.scan_workers, args.missing_report, dedupe_args)
     
     # 检查统计信息
     stats = db_interface.get_annotation_statistics()
@@ -0,0 +1,64 @@
+# utils/json_stream.py
+import json
+from typing import Any, Dict, Iterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+def iter_json_records(filename: str, chunk_size: int = 1 << 20) -> Iterator[Dict[str, Any]]:
+    """
+    增量读取 JSON 数组或 NDJSON（每行一个对象）文件，逐条产出记录
+
+    每次只读入 chunk_size 个字符，用 raw_decode 解析缓冲区中已完整的对象，
+    内存占用与文件大小无关，只与单条记录大小有关。
+
+    Args:
+        filename: 文件路径
+        chunk_size: 每次读取的字符数
+
+    Yields:
+        Dict: 一条记录
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        eof = not buffer
+        pos = 0
+
+        def skip(chars: str):
+            nonlocal pos
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+
+        skip(_WHITESPACE + "﻿")
+        while pos >= len(buffer) and not eof:
+            buffer = f.read(chunk_size)
+            eof = not buffer
+            pos = 0
+            skip(_WHITESPACE)
+        in_array = pos < len(buffer) and buffer[pos] == '['
+        if in_array:
+            pos += 1
+
+        while True:
+            skip(_WHITESPACE + (',' if in_array else ''))
+            if in_array and pos < len(buffer) and buffer[pos] == ']':
+                return
+            if pos >= len(buffer) and eof:
+                if in_array:
+                    raise ValueError("JSON 数组未结束")
+                return
+            try:
+                if pos >= len(buffer):
+                    raise ValueError("缓冲区为空")
+                record, end = _decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise ValueError(f"无法解析的 JSON 内容: {buffer[pos:pos + 80]!r}")
+                # 记录不完整，丢弃已解析的部分并继续读取
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            pos = end
+            yield record
@@ -0,0 +1,229 @@
+# utils/metrics.py
+import time
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for k, v in labels:
+        v = v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表（计数器与直方图），按 Prometheus 文本格式输出
+
+    缓存命中率等由其它模块持有的数据通过 register_collector 在输出时读取。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # name -> {label_key: value}
+        self._histograms = {}  # name -> {label_key: _Histogram}
+        self._help = {}
+        self._buckets = {}
+        self._collectors = {}  # key -> Callable[[], Iterable[(name, type, labels, value)]]
+
+    def describe(self, name: str, help_text: str, buckets: Optional[Tuple[float, ...]] = None):
+        self._help[name] = help_text
+        if buckets:
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    def register_collector(self, key: str, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, Any], float]]]):
+        """注册输出时调用的采集函数，同一 key 重复注册时覆盖"""
+        with self._lock:
+            self._collectors[key] = collector
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """记录代码块耗时到 name_seconds 直方图，出错时 name_errors_total 加一"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - started, **labels)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in series.items()}
+                          for name, series in self._histograms.items()}
+            collectors = list(self._collectors.values())
+
+        gauges = {}
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                continue
+            for name, metric_type, labels, value in samples:
+                target = counters if metric_type == "counter" else gauges
+                target.setdefault(name, {})[_label_key(labels)] = value
+
+        for name in sorted(counters):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        for name in sorted(gauges):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(gauges[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        for name in sorted(histograms):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (buckets, counts, total, count) in sorted(histograms[name].items()):
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("annotation_db_operation_seconds", "Database 接口方法耗时")
+REGISTRY.describe("annotation_db_operation_errors_total", "Database 接口方法抛出异常的次数")
+REGISTRY.describe("annotation_handler_seconds", "业务逻辑处理函数耗时")
+REGISTRY.describe("annotation_handler_errors_total", "业务逻辑处理函数抛出异常的次数")
+REGISTRY.describe("annotation_cache_hits_total", "缓存命中次数")
+REGISTRY.describe("annotation_cache_misses_total", "缓存未命中次数")
+REGISTRY.describe("annotation_cache_hit_ratio", "缓存命中率")
+
+class ActionContext:
+    """一次界面操作（或后台任务）的上下文，用于把底层开销归属到触发它的操作"""
+    def __init__(self, name: str):
+        self.name = name
+        self.commands = 0
+        self.mongo_seconds = 0.0
+        self.by_command = {}  # "命令 集合" -> 次数
+
+current_action: ContextVar[Optional[ActionContext]] = ContextVar("current_action", default=None)
+_action_hooks = []
+
+def add_action_hook(hook: Callable[[ActionContext], None]):
+    """注册在每个操作结束时调用的函数"""
+    _action_hooks.append(hook)
+
+def remove_action_hook(hook: Callable[[ActionContext], None]):
+    """移除 add_action_hook 注册的函数，未注册时忽略"""
+    try:
+        _action_hooks.remove(hook)
+    except ValueError:
+        pass
+
+@contextmanager
+def action_scope(name: str, nested: bool = False):
+    """
+    标记当前操作；已处在某个操作中时沿用外层操作
+
+    Args:
+        name: 操作名
+        nested: 为True时总是开启新的子操作，名称为 "外层>name"（用于后台预取等）
+    """
+    parent = current_action.get()
+    if parent is not None and not nested:
+        yield parent
+        return
+    ctx = ActionContext(f"{parent.name}>{name}" if parent is not None else name)
+    token = current_action.set(ctx)
+    try:
+        yield ctx
+    finally:
+        current_action.reset(token)
+        for hook in _action_hooks:
+            try:
+                hook(ctx)
+            except Exception:
+                pass
+
+def cache_samples(cache_name: str, stats: Dict[str, Any]):
+    """把各缓存 stats() 的结果转换为命中、未命中与命中率样本"""
+    labels = {"cache": cache_name}
+    hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+    return [
+        ("annotation_cache_hits_total", "counter", labels, hits),
+        ("annotation_cache_misses_total", "counter", labels, misses),
+        ("annotation_cache_hit_ratio", "gauge", labels, hits / (hits + misses) if hits + misses else 0.0),
+    ]
+
+def instrument_methods(metric: str, label: str):
+    """
+    类装饰器：为类中定义的所有公开方法（含 async 方法）记录耗时、调用次数与异常次数，
+    并以 "类名.方法名" 标记当前操作（外层已有操作时沿用外层）
+
+    Args:
+        metric: 指标名前缀，生成 {metric}_seconds 与 {metric}_errors_total
+        label: 方法名所用的标签名
+    """
+    def decorate(cls):
+        component = cls.__name__
+        for name, func in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.isfunction(func):
+                continue
+            labels = {"component": component, label: name}
+            action = f"{component}.{name}"
+            if inspect.iscoroutinefunction(func):
+                def wrap(func=func, labels=labels, action=action):
+                    @functools.wraps(func)
+                    async def wrapper(*args, **kwargs):
+                        with action_scope(action), REGISTRY.timer(metric, **labels):
+                            return await func(*args, **kwargs)
+                    return wrapper
+            else:
+                def wrap(func=func, labels=labels, action=action):
+                    @functools.wraps(func)
+                    def wrapper(*args, **kwargs):
+                        with action_scope(action), REGISTRY.timer(metric, **labels):
+                            return func(*args, **kwargs)
+                    return wrapper
+            setattr(cls, name, wrap())
+        return cls
+    return decorate
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from database import Database
+from utils.image_utils import open_task_images
+from services.llm_service import generate_draft_text, close_async_llm_client, LLM_DISABLED_MESSAGE
+from config import LLM_ENABLED
+
+def load_checkpoint(path: str) -> Optional[str]:
+    """读取断点文件，返回最后处理完成的任务ID"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('last_id')
+
+def save_checkpoint(path: str, last_id: str, stats: Dict[str, Any]):
+    """原子写入断点文件"""
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'last_id': last_id, 'updated_at': datetime.now().isoformat(), **stats}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+async def generate_for_task(task: Dict[str, Any], semaphore: asyncio.Semaphore) -> Optional[str]:
+    async with semaphore:
+        lq_image, hq_image = await asyncio.to_thread(open_task_images, task)
+        if lq_image is None or hq_image is None:
+            print(f"警告: 任务 {task['_id']} 图像无法读取，跳过")
+            return None
+        return await generate_draft_text(lq_image, hq_image, task.get('tag'))
+
+async def pregenerate(db_interface: Database, batch_size: int, concurrency: int,
+                      checkpoint_path: Optional[str], limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    为待标注任务预生成评价文本
+
+    按 _id 顺序分批读取尚未生成文本的待标注任务，批内以有限并发调用 LLM，
+    每批结果一次 bulk_write 写回后更新断点文件，中断后可从断点继续。
+
+    Args:
+        db_interface: 数据库接口
+        batch_size: 每批任务数量
+        concurrency: 同时进行的生成数量
+        checkpoint_path: 断点文件路径，为空则不记录
+        limit: 最多处理的任务数量
+
+    Returns:
+        Dict: 处理、写回与失败数量
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    last_id = load_checkpoint(checkpoint_path)
+    if last_id:
+        print(f"从断点继续: _id > {last_id}")
+
+    stats = {'processed': 0, 'written': 0, 'failed': 0}
+    started = time.perf_counter()
+    try:
+        while limit is None or stats['processed'] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - stats['processed'])
+            tasks = await asyncio.to_thread(db_interface.find_pending_without_text, size, last_id)
+            if not tasks:
+                break
+
+            results = await asyncio.gather(*(generate_for_task(task, semaphore) for task in tasks))
+            texts = {str(task['_id']): text for task, text in zip(tasks, results) if text}
+            written = await asyncio.to_thread(db_interface.set_generated_texts, texts)
+
+            last_id = str(tasks[-1]['_id'])
+            stats['processed'] += len(tasks)
+            stats['written'] += written
+            stats['failed'] += len(tasks) - len(texts)
+            save_checkpoint(checkpoint_path, last_id, stats)
+
+            elapsed = time.perf_counter() - started
+            print(f"已处理 {stats['processed']} 个任务，写回 {stats['written']}，失败 {stats['failed']}，"
+                  f"{stats['processed'] / elapsed:.2f} 个/秒")
+    finally:
+        await close_async_llm_client()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="为待标注任务预生成评价文本草稿")
+    parser.add_argument('--mongodb_uri', type=str, default='mongodb://localhost:27017/')
+    parser.add_argument('--db_name', type=str, default='annotation')
+    parser.add_argument('--collection_name', type=str, default='annotations')
+    parser.add_argument('--batch_size', type=int, default=64, help='每批读取与写回的任务数量')
+    parser.add_argument('--concurrency', type=int, default=8, help='同时进行的LLM请求数量')
+    parser.add_argument('--checkpoint', type=str, default='pregenerate_checkpoint.json', help='断点文件路径')
+    parser.add_argument('--restart', action='store_true', help='忽略断点从头开始（可用于重试失败的任务）')
+    parser.add_argument('--limit', type=int, default=None, help='最多处理的任务数量')
+    args = parser.parse_args()
+
+    if not LLM_ENABLED:
+        parser.error(LLM_DISABLED_MESSAGE)
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    db_interface = Database(
+        mongodb_uri=args.mongodb_uri,
+        db_name=args.db_name,
+        collection_name=args.collection_name
+    )
+    try:
+        stats = asyncio.run(pregenerate(db_interface, args.batch_size, args.concurrency, args.checkpoint, args.limit))
+        print(f"预生成完成: {stats}")
+    finally:
+        db_interface.close_connection()
+
+if __name__ == "__main__":
+    main()
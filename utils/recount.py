@@ -0,0 +1,29 @@
+import argparse
+import json
+
+from database import Database
+
+def main():
+    parser = argparse.ArgumentParser(description="全量重新计算标注状态计数器并报告偏差")
+    parser.add_argument('--mongodb_uri', type=str, default='mongodb://localhost:27017/')
+    parser.add_argument('--db_name', type=str, default='annotation')
+    parser.add_argument('--collection_name', type=str, default='annotations')
+    args = parser.parse_args()
+
+    db_interface = Database(
+        mongodb_uri=args.mongodb_uri,
+        db_name=args.db_name,
+        collection_name=args.collection_name
+    )
+
+    result = db_interface.recompute_annotation_statistics()
+    drift = result['drift']
+    if drift:
+        print(f"发现 {len(drift)} 处计数偏差（实际值 - 计数值），已修正:")
+        print(json.dumps(drift, ensure_ascii=False, indent=2))
+    else:
+        print("计数器与实际数据一致")
+    print(f"数据库统计: {db_interface.get_annotation_statistics()}")
+
+if __name__ == "__main__":
+    main()